@@ -3,8 +3,19 @@
 """
 import os
 import json
+import codecs
+import copy
+import functools
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
+
+from utils.JsonUtils import json_loads, json_dumps
+
+
+@functools.lru_cache(maxsize=256)
+def _split_path(key_path: str) -> Tuple[str, ...]:
+    """拆分点分隔的配置路径，同一路径只拆分一次"""
+    return tuple(key_path.split('.'))
 
 
 class Config:
@@ -16,11 +27,14 @@ class Config:
     "name": "zai-org/GLM-OCR",
     "local_path": "./models/GLM-OCR",
     "device": "auto",
-    "torch_dtype": "float16",
+    "torch_dtype": "auto",
     "max_new_tokens": 2048,
     "max_new_tokens_limit": 8192,
     "use_local_only": True,
-    "quantization": "none"
+    "quantization": "auto",
+    "compile_model": True,
+    "compile_mode": "reduce-overhead",
+    "attn_implementation": "auto"
   },
   "ocr": {
     "language": "简体中文",
@@ -40,6 +54,9 @@ class Config:
     "window_size": "1200x800"
   }
 }
+    # 默认配置的序列化模板：每次 json.loads 得到一份独立的深拷贝，
+    # 避免 dict.copy() 浅拷贝导致 set() 修改到 DEFAULT_CONFIG 本身
+    _DEFAULT_JSON = json.dumps(DEFAULT_CONFIG).encode()
     README_STR = """
      ===========================================                                                                                                                 
        GLM-OCR 配置说明 (config.json)                                                                                                                         
@@ -62,9 +79,10 @@ class Config:
                   cpu   - 强制使用CPU
 
     torch_dtype   模型精度
-                  float16 - 半精度（推荐，省显存）
-                  auto    - 自动选择
-                  float32 - 全精度（更准但占用翻倍）
+                  auto     - 自动选择（默认）：显卡支持时用 bfloat16，否则 float16
+                  float16  - 半精度（省显存）
+                  bfloat16 - 半精度（数值更稳定，需 30 系及以上显卡）
+                  float32  - 全精度（更准但占用翻倍）
 
     max_new_tokens  最大生成字数
                     默认: 2048
@@ -75,11 +93,27 @@ class Config:
                     false - 允许从 HuggingFace 在线下载
 
     quantization    量化模式（降低内存占用）
-                    none  - 不量化，使用 float16（默认）
+                    auto  - 自动选择（默认）：有显卡且已安装 bitsandbytes 时使用 4bit，否则不量化
+                    none  - 不量化，使用 float16
                     8bit  - 8位量化（内存减半，效果几乎无损）
                     4bit  - 4位量化（内存降至1/4，效果略有下降）
                     注意: 8bit/4bit 需要安装 bitsandbytes 库
 
+    compile_model   是否用 torch.compile 编译模型（仅显卡模式生效，8bit/4bit 量化时不编译）
+                    true  - 编译（默认，加载时多花一些时间，识别更快）
+                    false - 不编译
+
+    compile_mode    编译模式
+                    reduce-overhead - 使用 CUDA Graph 减少逐 token 开销（默认）
+                    default         - 普通编译
+                    max-autotune    - 自动调优（编译最慢）
+
+    attn_implementation  注意力实现
+                    auto              - 自动选择（默认）：装了 flash_attn 用 FlashAttention-2，否则 sdpa
+                    flash_attention_2 - FlashAttention-2（需安装 flash_attn，仅显卡）
+                    sdpa              - PyTorch 融合注意力
+                    eager             - 普通实现（最慢，仅用于排查问题）
+
   【识别设置 ocr】
 
     language      识别语言
@@ -119,6 +153,9 @@ class Config:
     font_size     字体大小，默认 12
     window_size   窗口尺寸，默认 1200x800
     """
+    # 说明文件的最终字节内容（与文本模式写入一致，换行转换为系统换行符），只编码一次
+    _README_UTF8 = README_STR.replace("\n", os.linesep).encode("utf-8")
+    _README_GBK = README_STR.replace("\n", os.linesep).encode("gbk")
 
 
     def __init__(self, config_path: str = None, base_dir: Path = None):
@@ -142,13 +179,13 @@ class Config:
             self.internal_dir = self.base_dir
 
         if config_path is None:
-            config_path = self.base_dir / "config.json"
-        readme_path_utf8 = self.base_dir / "readme_utf8.txt"
-        readme_path_gbk = self.base_dir / "readme_gbk.txt"
-
-        self.config_path = Path(config_path)
-        self.readme_path_utf8 = Path(readme_path_utf8)
-        self.readme_path_gbk = Path(readme_path_gbk)
+            self.config_path = self.base_dir / "config.json"
+        else:
+            self.config_path = Path(config_path)
+        self.readme_path_utf8 = self.base_dir / "readme_utf8.txt"
+        self.readme_path_gbk = self.base_dir / "readme_gbk.txt"
+        # get() 叶子值缓存，键为原始 key_path，配置变更时清空
+        self._get_cache: Dict[str, Any] = {}
         self.config = self.load_config()
 
         # 自动检测本地模型
@@ -167,17 +204,22 @@ class Config:
                 print(f"✓ 使用配置的本地模型: {local_path}")
                 return
 
-        # 检测模型目录
-        local_model_paths = [
-            self.internal_dir / "models" / "GLM-OCR",  # PyInstaller: _internal/models/GLM-OCR; 开发: 项目根/models/GLM-OCR
-            self.base_dir / "models" / "GLM-OCR",      # EXE同级/models/GLM-OCR（用户手动放置）
-        ]
+        # 检测模型目录（开发环境下两者相同，用 dict.fromkeys 去重并保持顺序）
+        local_model_paths = dict.fromkeys([
+            (self.internal_dir / "models" / "GLM-OCR").absolute(),  # PyInstaller: _internal/models/GLM-OCR; 开发: 项目根/models/GLM-OCR
+            (self.base_dir / "models" / "GLM-OCR").absolute(),      # EXE同级/models/GLM-OCR（用户手动放置）
+        ])
 
         for path in local_model_paths:
-            if path.exists() and (path / "model.safetensors").exists():
-                print(f"✓ 自动检测到本地模型: {path.absolute()}")
-                self.config["model"]["local_path"] = str(path.absolute())
-                return
+            # 直接 stat 权重文件：文件存在即说明目录存在，每个候选只需一次系统调用
+            try:
+                os.stat(path / "model.safetensors")
+            except OSError:
+                continue
+            print(f"✓ 自动检测到本地模型: {path}")
+            self.config["model"]["local_path"] = str(path)
+            self._clear_caches()
+            return
 
         print("⚠ 未检测到本地模型，将从 HuggingFace 下载")
 
@@ -188,77 +230,108 @@ class Config:
             return str(Path(local_path).absolute())
         return self.config["model"]["name"]
 
+    def _clear_caches(self):
+        """配置变更后清空查询缓存"""
+        self._get_cache.clear()
+
     def load_config(self) -> Dict[str, Any]:
         """加载配置文件"""
         if self.config_path.exists():
             try:
-                with open(self.config_path, 'r', encoding='utf-8') as f:
-                    loaded_config = json.load(f)
-                with open(self.readme_path_utf8, 'w', encoding='utf-8') as f:
-                    f.write(self.README_STR)
-                with open(self.readme_path_gbk, 'w', encoding='gbk') as f:
-                    f.write(self.README_STR)
+                with open(self.config_path, 'rb') as f:
+                    data = f.read()
+                # 兼容 Windows 记事本保存的带 BOM 的 UTF-8 文件（orjson 不接受 BOM）
+                if data.startswith(codecs.BOM_UTF8):
+                    data = data[len(codecs.BOM_UTF8):]
+                loaded_config = json_loads(data)
+                self._write_readme()
                 print(f"✓ 已加载配置文件: {self.config_path}")
-                return self._merge_config(self.DEFAULT_CONFIG.copy(), loaded_config)
+                return self._merge_config(json_loads(self._DEFAULT_JSON), loaded_config)
             except Exception as e:
                 print(f"加载配置失败: {e}, 使用默认配置")
-                return self.DEFAULT_CONFIG.copy()
+                return json_loads(self._DEFAULT_JSON)
         else:
             print(f"⚠ 未找到配置文件: {self.config_path}，自动创建默认配置")
-            config = self.DEFAULT_CONFIG.copy()
+            config = json_loads(self._DEFAULT_JSON)
             # 自动生成默认配置文件到程序目录
             try:
-                with open(self.config_path, 'w', encoding='utf-8') as f:
-                    json.dump(config, f, indent=2, ensure_ascii=False)
-                with open(self.readme_path_utf8,'w',encoding='utf-8') as f:
-                    f.write(self.README_STR)
-                with open(self.readme_path_gbk,'w',encoding='gbk') as f:
-                    f.write(self.README_STR)
+                with open(self.config_path, 'wb') as f:
+                    f.write(json_dumps(config))
+                self._write_readme()
                 print(f"✓ 已创建默认配置文件: {self.config_path}")
             except Exception as e:
                 print(f"⚠ 创建配置文件失败: {e}")
             return config
 
+    def _write_readme(self):
+        """写出配置说明文件，内容未变化时跳过写入"""
+        for path, data in ((self.readme_path_utf8, self._README_UTF8),
+                           (self.readme_path_gbk, self._README_GBK)):
+            try:
+                if path.stat().st_size == len(data) and path.read_bytes() == data:
+                    continue
+            except OSError:
+                pass
+            path.write_bytes(data)
+
     def save_config(self) -> bool:
         """保存配置到文件"""
         try:
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, indent=2, ensure_ascii=False)
+            with open(self.config_path, 'wb') as f:
+                f.write(json_dumps(self.config))
             return True
         except Exception as e:
             print(f"保存配置失败: {e}")
             return False
 
     def _merge_config(self, default: Dict, loaded: Dict) -> Dict:
-        """递归合并配置"""
-        for key, value in loaded.items():
-            if key in default and isinstance(default[key], dict) and isinstance(value, dict):
-                default[key] = self._merge_config(default[key], value)
-            else:
-                default[key] = value
+        """合并配置（显式栈迭代，原地修改并返回 default）"""
+        stack = [(default, loaded)]
+        while stack:
+            target, source = stack.pop()
+            for key, value in source.items():
+                if isinstance(value, dict) and isinstance(target.get(key), dict):
+                    stack.append((target[key], value))
+                else:
+                    target[key] = value
         return default
 
     def get(self, key_path: str, default=None):
-        """获取配置值"""
-        keys = key_path.split('.')
+        """
+        获取配置值（叶子值命中缓存时只需一次字典查找）
+
+        dict / list 等容器值返回深拷贝且不缓存：调用方修改返回值不会影响配置，
+        也不会让已缓存的子键变成旧值；修改配置请使用 set()
+        """
+        try:
+            return self._get_cache[key_path]
+        except KeyError:
+            pass
+
         value = self.config
-        for key in keys:
+        for key in _split_path(key_path):
             if isinstance(value, dict) and key in value:
                 value = value[key]
             else:
+                # 不缓存缺失的键，default 可能随调用而不同
                 return default
+        if isinstance(value, (dict, list)):
+            return copy.deepcopy(value)
+        self._get_cache[key_path] = value
         return value
 
     def set(self, key_path: str, value):
         """设置配置值"""
-        keys = key_path.split('.')
+        keys = _split_path(key_path)
         config = self.config
         for key in keys[:-1]:
             if key not in config:
                 config[key] = {}
             config = config[key]
         config[keys[-1]] = value
+        self._clear_caches()
 
     def reset_to_default(self):
         """重置为默认配置"""
-        self.config = self.DEFAULT_CONFIG.copy()
\ No newline at end of file
+        self.config = json_loads(self._DEFAULT_JSON)
+        self._clear_caches()
\ No newline at end of file
@@ -5,11 +5,21 @@ OCR 引擎模块
 包含内存优化：低内存加载、推理后回收、可选量化
 """
 import gc
+import io
+import os
+import base64
+import hashlib
+import traceback
+import contextlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import torch
 from pathlib import Path
-from typing import Union, List, Dict, Optional
-from PIL import Image
-from transformers import AutoProcessor, AutoModelForImageTextToText
+from types import MappingProxyType
+from typing import Union, List, Dict, Mapping, Optional
+from PIL import Image, ImageOps
+from transformers import AutoProcessor, AutoModelForImageTextToText, BatchFeature, TextIteratorStreamer
 
 
 class OCREngine:
@@ -18,8 +28,48 @@ class OCREngine:
     # 超过此尺寸的图片会在预处理时等比缩放，避免浪费内存
     MAX_IMAGE_LONG_EDGE = 4096
 
+    # 配置中的精度名称
+    TORCH_DTYPES = {
+        "float16": torch.float16,
+        "bfloat16": torch.bfloat16,
+        "float32": torch.float32,
+    }
+
+    # 量化模式别名
+    QUANTIZATION_ALIASES = {"int8": "8bit", "nf4": "4bit"}
+
+    # 批量识别时同一批次内最大/最小图片面积之比的上限
+    MAX_BATCH_AREA_RATIO = 2.0
+
+    # 静态 KV cache 模式下输入长度补齐的最小档位
+    STATIC_BUCKET_MIN = 64
+
+    # 会把编译后的 forward 捕获为 CUDA Graph 的 torch.compile 模式
+    CUDA_GRAPH_COMPILE_MODES = ("reduce-overhead", "max-autotune")
+
+    # 按图片 token 数估算生成上限：图片 token 数 × TOKEN_BUDGET_FACTOR + MIN_NEW_TOKENS
+    # 表格 HTML、公式 LaTeX 在窄小裁剪图上的输出可能超过图片 token 数，因此留足余量
+    MIN_NEW_TOKENS = 256
+    TOKEN_BUDGET_FACTOR = 4
+
+    # 图像处理器输出缓存的总大小上限（字节）
+    IMAGE_CACHE_BYTES = 512 * 1024 * 1024
+
+    # 可选的 TurboJPEG 解码器（None 表示尚未尝试加载，False 表示不可用）
+    _turbojpeg = None
+
+    # 支持的提示词类型（只读，所有实例共享）
+    _SUPPORTED_PROMPTS = MappingProxyType({
+        "text_recognition": "Text Recognition:",
+        "document_parsing": "Document Parsing:",
+        "table_recognition": "Table Recognition:",
+        "formula_recognition": "Formula Recognition:"
+    })
+
     def __init__(self, model_path: str = "zai-org/GLM-OCR", device: str = "auto",
-                 use_local_only: bool = False, quantization: str = "none"):
+                 use_local_only: bool = False, quantization: str = "auto",
+                 compile_model: bool = True, compile_mode: str = "reduce-overhead",
+                 torch_dtype: str = "auto", attn_impl: str = "auto"):
         """
         初始化 OCR 引擎
 
@@ -27,15 +77,82 @@ class OCREngine:
             model_path: 模型路径或 HuggingFace 模型名称
             device: 设备 (auto, cpu, cuda, cuda:0, etc.)
             use_local_only: 是否仅使用本地模型，不连接 HuggingFace
-            quantization: 量化模式 ("none", "8bit", "4bit")
+            quantization: 量化模式 ("auto", "none", "8bit", "4bit"，也接受 "int8" / "nf4")，
+                auto 在 CUDA 可用且安装了 bitsandbytes 时使用 4bit NF4，否则不量化
+            compile_model: CUDA 上是否用 torch.compile 编译模型（8bit/4bit 量化模型不编译）
+            compile_mode: torch.compile 模式 ("reduce-overhead", "default", "max-autotune")
+            torch_dtype: 模型精度 ("auto", "float16", "bfloat16", "float32")，
+                auto 在支持 bfloat16 的显卡（Ampere 及以上）上使用 bfloat16，否则 float16
+            attn_impl: 注意力实现 ("auto", "flash_attention_2", "sdpa", "eager")，
+                auto 在 CUDA + 半精度且安装了 flash_attn 时使用 FlashAttention-2，否则 sdpa
         """
         self.model_path = model_path
         self.device = device
         self.use_local_only = use_local_only
+        quantization = self.QUANTIZATION_ALIASES.get(quantization, quantization)
+        if quantization == "auto":
+            quantization = self._resolve_auto_quantization(device)
         self.quantization = quantization
+        self.torch_dtype = self._resolve_dtype(torch_dtype, device)
+        self.attn_impl = self._resolve_attn_impl(attn_impl, device, self.torch_dtype)
+        self.compile_model = compile_model
+        self.compile_mode = compile_mode
         self.processor = None
         self.model = None
         self._is_loaded = False
+        # 处理器是否接受内存中的 PIL Image（None 表示尚未探测）
+        self._pil_input_supported = None
+        # 模型编译成功后启用静态 KV cache 与输入长度分档
+        self._use_static_cache = False
+        # 提示词模板分词缓存；快速路径是否与完整路径一致，按 (提示词, 是否批量) 记录，缺失表示尚未验证
+        self._prompt_templates: Dict[str, Optional[tuple]] = {}
+        self._fast_inputs_ok: Dict[tuple, bool] = {}
+        # 图像处理器输出的 LRU 缓存：键见 _image_cache_key，值为处理器输出
+        self._image_cache: "OrderedDict[tuple, Dict[str, torch.Tensor]]" = OrderedDict()
+        self._image_cache_bytes = 0
+        # 批量预取：处理器调用互斥锁、CUDA 拷贝流
+        self._processor_lock = threading.Lock()
+        self._copy_stream = None
+        # 专用推理线程：预热和所有 generate 都在同一线程执行（见 _submit_generate）
+        self._generate_executor = None
+
+    @classmethod
+    def _resolve_dtype(cls, torch_dtype: str, device: str) -> torch.dtype:
+        """解析模型精度：bfloat16 与 float16 同样省显存，但指数位更宽，注意力 softmax 不易溢出"""
+        if torch_dtype in cls.TORCH_DTYPES:
+            return cls.TORCH_DTYPES[torch_dtype]
+        if (not str(device).startswith("cpu") and torch.cuda.is_available()
+                and torch.cuda.is_bf16_supported()):
+            return torch.bfloat16
+        return torch.float16
+
+    @staticmethod
+    def _resolve_attn_impl(attn_impl: str, device: str, dtype: torch.dtype) -> str:
+        """
+        解析注意力实现：FlashAttention-2 / SDPA 都是融合内核，不物化 N×N 注意力矩阵，
+        避免 transformers 退回 eager 注意力
+        """
+        if attn_impl != "auto":
+            return attn_impl
+        if (not str(device).startswith("cpu") and torch.cuda.is_available()
+                and dtype in (torch.float16, torch.bfloat16)):
+            try:
+                import flash_attn  # noqa: F401
+                return "flash_attention_2"
+            except ImportError:
+                pass
+        return "sdpa"
+
+    @staticmethod
+    def _resolve_auto_quantization(device: str) -> str:
+        """auto 量化：显存带宽是瓶颈的 CUDA 环境下默认 4bit，其余情况不量化"""
+        if str(device).startswith("cpu") or not torch.cuda.is_available():
+            return "none"
+        try:
+            import bitsandbytes  # noqa: F401
+        except ImportError:
+            return "none"
+        return "4bit"
 
     def load_model(self, progress_callback=None) -> bool:
         """
@@ -67,12 +184,15 @@ class OCREngine:
             # 构建加载参数
             load_kwargs = dict(
                 pretrained_model_name_or_path=self.model_path,
-                torch_dtype=torch.float16,
+                torch_dtype=self.torch_dtype,
+                # 权重按 device_map 逐片从 mmap 的 safetensors 直接放到目标设备；
+                # "auto" 时显存放不下的层自动分配到 CPU
                 device_map=self.device,
                 trust_remote_code=True,
                 local_files_only=self.use_local_only,
                 # 逐片加载权重，避免峰值内存翻倍（最关键的优化）
                 low_cpu_mem_usage=True,
+                attn_implementation=self.attn_impl,
             )
 
             # 可选量化：进一步降低内存占用
@@ -86,14 +206,31 @@ class OCREngine:
                     elif self.quantization == "4bit":
                         load_kwargs["quantization_config"] = BitsAndBytesConfig(
                             load_in_4bit=True,
-                            bnb_4bit_compute_dtype=torch.float16,
+                            bnb_4bit_compute_dtype=self.torch_dtype,
                             bnb_4bit_quant_type="nf4"
                         )
                     print(f"使用 {self.quantization} 量化加载模型")
                 except ImportError:
-                    print("bitsandbytes 未安装，跳过量化，使用 float16")
+                    print(f"bitsandbytes 未安装，跳过量化，使用 {self.torch_dtype}")
 
-            self.model = AutoModelForImageTextToText.from_pretrained(**load_kwargs)
+            try:
+                self.model = AutoModelForImageTextToText.from_pretrained(**load_kwargs)
+            except (ValueError, ImportError) as e:
+                # 模型不支持所选注意力实现时交给 transformers 自动选择
+                print(f"注意力实现 {self.attn_impl} 不可用，改用默认实现: {e}")
+                load_kwargs.pop("attn_implementation")
+                self.attn_impl = "default"
+                self.model = AutoModelForImageTextToText.from_pretrained(**load_kwargs)
+            self._optimize_model()
+
+            if self.compile_model and self.model.device.type == "cuda":
+                if "quantization_config" in load_kwargs:
+                    # bitsandbytes 量化层无法被 torch.compile 完整追踪，编译与预热只会拖慢启动
+                    print(f"{self.quantization} 量化模型不编译，使用 eager 模式")
+                else:
+                    if progress_callback:
+                        progress_callback("正在编译模型（首次较慢）...", 0.8)
+                    self._compile_model()
 
             # 加载完成后立即回收加载过程中的临时内存
             gc.collect()
@@ -109,6 +246,7 @@ class OCREngine:
             print(f"✓ 模式: {'仅本地' if self.use_local_only else '在线/本地'}")
             if self.quantization != "none":
                 print(f"✓ 量化: {self.quantization}")
+            print(f"✓ 注意力: {self.attn_impl}")
             return True
 
         except Exception as e:
@@ -128,54 +266,573 @@ class OCREngine:
                 print(f"3. 检查网络连接")
             return False
 
+    def _optimize_model(self):
+        """加载后的一次性推理优化：eval 模式、视觉塔 channels_last、启用 TF32"""
+        self.model.eval()
+
+        # 视觉塔的卷积 patch embedding 在 channels_last 布局下走更快的 cuDNN 内核
+        vision_tower = self._get_vision_tower()
+        if vision_tower is not None:
+            try:
+                vision_tower.to(memory_format=torch.channels_last)
+            except Exception as e:
+                print(f"视觉模块 channels_last 转换失败，保持默认布局: {e}")
+
+        if torch.cuda.is_available():
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
+
+        # 显式设置 pad_token_id，避免每次 generate 都打印警告；
+        # eos_token_id 保留模型 generation_config 中的设置（可能包含多个结束符）
+        generation_config = getattr(self.model, "generation_config", None)
+        tokenizer = getattr(self.processor, "tokenizer", None)
+        if generation_config is not None and tokenizer is not None and generation_config.pad_token_id is None:
+            pad_token_id = tokenizer.pad_token_id
+            if pad_token_id is None:
+                pad_token_id = tokenizer.eos_token_id
+            generation_config.pad_token_id = pad_token_id
+
+    def _compile_model(self):
+        """
+        用 torch.compile 编译模型 forward（generate 的每个解码步都调用它），
+        reduce-overhead 模式以 CUDA Graph 重放解码步，去掉逐 token 的 Python 开销。
+        编译在预热时完成；预热失败则恢复 eager 模式。
+        编译产物缓存在 TORCHINDUCTOR_CACHE_DIR（由 main.py 设置），再次启动可复用。
+
+        编译成功后 generate 使用静态 KV cache，并把输入长度补齐到固定档位，
+        保持张量形状不变，解码步才能作为 CUDA Graph 重放而不反复重新编译。
+        优先尝试 fullgraph=True，失败后退回 fullgraph=False。
+        """
+        eager_forward = self.model.forward
+        for fullgraph in (True, False):
+            self._use_static_cache = True
+            try:
+                self.model.forward = torch.compile(
+                    eager_forward, mode=self.compile_mode, fullgraph=fullgraph
+                )
+                self._warmup()
+                print(f"✓ 模型已编译 (torch.compile, fullgraph={fullgraph}, 静态 KV cache)")
+                if self.compile_mode in self.CUDA_GRAPH_COMPILE_MODES:
+                    print("✓ 解码步以 CUDA Graph 重放")
+                else:
+                    print(f"编译模式 {self.compile_mode} 不使用 CUDA Graph，"
+                          f"可改用 reduce-overhead 去掉逐 token 的内核启动开销")
+                return
+            except Exception as e:
+                print(f"torch.compile 编译失败 (fullgraph={fullgraph}): {e}")
+                self.model.forward = eager_forward
+                self._use_static_cache = False
+        print("使用 eager 模式")
+
+    def _generate(self, inputs, max_new_tokens: int, **extra_kwargs):
+        """调用 model.generate：贪心解码，已编译时使用静态 KV cache"""
+        generate_kwargs = dict(max_new_tokens=max_new_tokens, do_sample=False, **extra_kwargs)
+        if self._use_static_cache:
+            generate_kwargs["cache_implementation"] = "static"
+        return self.model.generate(**inputs, **generate_kwargs)
+
+    def _token_budget(self, inputs, max_new_tokens: int) -> int:
+        """
+        按图片 token 数收紧生成上限，小图不必为 max_new_tokens 步预留 KV cache。
+
+        上限取图片 token 数的 TOKEN_BUDGET_FACTOR 倍再加 MIN_NEW_TOKENS，
+        给表格、公式等比图片 token 更长的输出留出余量。
+
+        Returns:
+            收紧后的上限与 max_new_tokens 的较小值；
+            静态 KV cache 模式下向上取到 2 的幂，减少重新编译
+        """
+        grid = inputs.get("image_grid_thw")
+        merge_size = getattr(self.processor.image_processor, "merge_size", None)
+        if grid is None or not merge_size:
+            return max_new_tokens
+
+        image_tokens = max(t * h * w for t, h, w in grid.tolist()) // merge_size ** 2
+        budget = image_tokens * self.TOKEN_BUDGET_FACTOR + self.MIN_NEW_TOKENS
+        if self._use_static_cache:
+            budget = 1 << (budget - 1).bit_length()
+        return min(budget, max_new_tokens)
+
+    def _submit_generate(self, inputs, max_new_tokens: int, **extra_kwargs):
+        """
+        把 generate 提交到长期存在的专用推理线程，返回 Future
+
+        torch.compile 的 CUDA Graph（cudagraph trees）状态是线程局部的：预热时在哪个线程
+        录制，之后的 generate 就必须在同一线程重放，否则会重新录制或断言失败。
+        inference_mode 同样是线程局部的，在推理线程中进入。
+        """
+        if self._generate_executor is None:
+            self._generate_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr-generate")
+
+        def run():
+            with torch.inference_mode():
+                return self._generate(inputs, max_new_tokens, **extra_kwargs)
+
+        return self._generate_executor.submit(run)
+
+    def _run_generate(self, inputs, max_new_tokens: int, **extra_kwargs):
+        """在专用推理线程中 generate 并等待结果，异常（包括显存不足）在调用线程中重新抛出"""
+        return self._submit_generate(inputs, max_new_tokens, **extra_kwargs).result()
+
+    def _generate_streaming(self, inputs, max_new_tokens: int, stream_callback):
+        """
+        在专用推理线程中 generate，并通过 TextIteratorStreamer 将新生成的文本
+        逐段交给 stream_callback(text)；返回完整的 generated_ids。
+
+        generate 中的异常（包括显存不足）在调用线程中重新抛出。
+        """
+        streamer = TextIteratorStreamer(
+            self.processor.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True
+        )
+        future = self._submit_generate(inputs, max_new_tokens, streamer=streamer)
+        # generate 出错时结束迭代器，避免调用线程一直等待
+        future.add_done_callback(lambda f: streamer.end() if f.exception() is not None else None)
+
+        for text in streamer:
+            if text:
+                stream_callback(text)
+        return future.result()
+
+    def _pad_to_bucket(self, inputs):
+        """
+        将 input_ids 及对齐的掩码左侧补齐到 2 的幂长度（至少 STATIC_BUCKET_MIN），
+        使不同长度的提示落入少数几个固定形状，避免静态图重复编译。
+        """
+        pad_token_id = getattr(getattr(self.processor, "tokenizer", None), "pad_token_id", None)
+        if pad_token_id is None:
+            return inputs
+
+        seq_len = inputs["input_ids"].shape[1]
+        bucket = max(self.STATIC_BUCKET_MIN, 1 << (seq_len - 1).bit_length())
+        pad = bucket - seq_len
+        if pad == 0:
+            return inputs
+
+        for key, value in inputs.items():
+            if not isinstance(value, torch.Tensor) or value.dim() != 2 or value.shape[1] != seq_len:
+                continue
+            if key == "input_ids":
+                fill = pad_token_id
+            elif key.endswith("_ids") or key.endswith("mask"):
+                fill = 0
+            else:
+                continue
+            inputs[key] = torch.nn.functional.pad(value, (pad, 0), value=fill)
+        return inputs
+
+    def _warmup(self):
+        """用一张空白小图生成 2 个 token（预填充 + 一个解码步），提前完成编译"""
+        dummy = Image.new("RGB", (64, 64), "white")
+        inputs = self._prepare_inputs(dummy, "Text Recognition:")
+        self._run_generate(inputs, 2)
+
+    def _get_vision_tower(self):
+        """查找模型的视觉编码器子模块，找不到返回 None"""
+        for owner in (self.model, getattr(self.model, "model", None)):
+            if owner is None:
+                continue
+            for name in ("vision_model", "visual", "vision_tower"):
+                module = getattr(owner, name, None)
+                if isinstance(module, torch.nn.Module):
+                    return module
+        return None
+
+    @staticmethod
+    def _release_memory():
+        """回收 Python 对象并释放 CUDA 缓存显存"""
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
     def is_loaded(self) -> bool:
         """检查模型是否已加载"""
         return self._is_loaded
 
-    def _prepare_image(self, image: Union[str, Path, Image.Image]) -> str:
+    def _prepare_image(self, image: Union[str, Path, Image.Image]) -> Union[str, Image.Image]:
         """
-        预处理图片：限制超大图片尺寸以节省内存，返回可用的图片路径。
+        预处理图片：限制超大图片尺寸以节省内存。
 
-        对于超过 MAX_IMAGE_LONG_EDGE 的图片，等比缩放后保存到临时文件。
-        普通尺寸图片直接返回原始路径。
+        普通尺寸的图片路径直接返回原始路径，由处理器自行读取；
+        JPEG 在可用时先用 TurboJPEG 解码（见 _load_jpeg）；
+        PIL Image 输入、已解码的 JPEG 或超过 MAX_IMAGE_LONG_EDGE 的图片返回内存中的 PIL Image，
+        不再编码落盘。缩放生成新对象，不修改调用方传入的图片。
         """
-        import tempfile
-        import os
-
+        # 路径输入且只读取了文件头（尚未解码像素）
+        header_only = False
         if isinstance(image, Image.Image):
             pil_image = image
         else:
             pil_image = Image.open(str(image))
+            decoded = self._load_jpeg(str(image), pil_image)
+            if decoded is not None:
+                pil_image.close()
+                pil_image = decoded
+            else:
+                header_only = True
 
         w, h = pil_image.size
-        needs_temp = isinstance(image, Image.Image)
 
         # 超大图片等比缩放
         if max(w, h) > self.MAX_IMAGE_LONG_EDGE:
-            pil_image.thumbnail(
-                (self.MAX_IMAGE_LONG_EDGE, self.MAX_IMAGE_LONG_EDGE),
-                Image.LANCZOS
+            scale = self.MAX_IMAGE_LONG_EDGE / max(w, h)
+            # BILINEAR + reducing_gap：先按整数倍 box 降采样再做双线性插值，
+            # 比 LANCZOS 快数倍，对 OCR 识别效果几乎无影响
+            resized = pil_image.resize(
+                (max(1, round(w * scale)), max(1, round(h * scale))),
+                Image.Resampling.BILINEAR,
+                reducing_gap=2.0
             )
-            needs_temp = True
-
-        if needs_temp:
-            temp_dir = tempfile.gettempdir()
-            temp_path = os.path.join(temp_dir, "temp_ocr_image.png")
-            # 转为 RGB 避免 PNG 保存 RGBA 浪费空间
-            if pil_image.mode not in ("RGB", "L"):
-                pil_image = pil_image.convert("RGB")
-            pil_image.save(temp_path)
-            pil_image.close()
-            return temp_path
-        else:
+            if pil_image is not image:
+                pil_image.close()
+            pil_image = resized
+        elif header_only:
+            # 路径输入且尺寸正常：只读取了文件头，直接交给处理器
             pil_image.close()
             return str(image)
 
+        if pil_image.mode not in ("RGB", "L"):
+            pil_image = pil_image.convert("RGB")
+        return pil_image
+
+    @classmethod
+    def _load_jpeg(cls, path: str, header: Image.Image) -> Optional[Image.Image]:
+        """
+        可选的 JPEG 快速解码：安装了 PyTurboJPEG 时用 libjpeg-turbo 解码，
+        比 Pillow 自带的解码快数倍。
+
+        非 JPEG、带旋转 EXIF 方向（turbojpeg 不处理 EXIF）或库不可用时返回 None，
+        由处理器按原路径读取。
+
+        Args:
+            path: 图片路径
+            header: 已打开（只读取了文件头）的同一图片
+        """
+        if header.format != "JPEG" or header.getexif().get(0x0112, 1) != 1:
+            return None
+
+        if cls._turbojpeg is None:
+            try:
+                from turbojpeg import TurboJPEG
+                cls._turbojpeg = TurboJPEG()
+            except (ImportError, RuntimeError, OSError):
+                # 未安装 PyTurboJPEG 或找不到 libturbojpeg 动态库
+                cls._turbojpeg = False
+        if cls._turbojpeg is False:
+            return None
+
+        try:
+            from turbojpeg import TJPF_RGB
+            with open(path, "rb") as f:
+                pixels = cls._turbojpeg.decode(f.read(), pixel_format=TJPF_RGB)
+            return Image.fromarray(pixels, "RGB")
+        except Exception as e:
+            print(f"TurboJPEG 解码失败，改用 Pillow: {e}")
+            return None
+
+    @staticmethod
+    def _encode_data_url(pil_image: Image.Image) -> str:
+        """
+        将图片编码为 data URL，供只接受 URL 字符串的处理器使用。
+
+        在内存中完成编码，不写临时文件；PNG 使用最低压缩级别，编码更快。
+        """
+        buf = io.BytesIO()
+        pil_image.save(buf, format="PNG", compress_level=1)
+        return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+    @staticmethod
+    def _image_item(prepared: Union[str, Image.Image], source=None) -> Dict:
+        """
+        构建消息中的图片项：内存图片用 image 字段，路径用 url 字段
+
+        Args:
+            source: 内存图片由文件解码而来时的原始路径（作为缓存键，无需哈希像素）
+        """
+        if isinstance(prepared, Image.Image):
+            item = {"type": "image", "image": prepared}
+            if isinstance(source, (str, Path)):
+                item["source"] = str(source)
+            return item
+        return {"type": "image", "url": prepared}
+
+    def _template_image_item(self, item: Dict) -> Dict:
+        """
+        交给 apply_chat_template 的图片项：处理器不接受 PIL Image 时，内存图片改为 data URL。
+        只有完整路径需要编码，快速路径直接使用内存图片
+        """
+        if "image" in item:
+            if self._pil_input_supported is False:
+                return {"type": "image", "url": self._encode_data_url(item["image"])}
+            # source 只用作缓存键，不交给模板
+            return {"type": "image", "image": item["image"]}
+        return item
+
+    def _build_inputs(self, image_items: List[Dict], prompt: str, stream=None):
+        """
+        按官方文档构建消息并处理为模型输入，多张图片时按批次左侧填充
+
+        优先走快速路径（复用缓存的提示词 token，只运行图像处理器）；
+        每个提示词的单张与批量（左侧填充）快速路径首次使用时分别与完整的
+        apply_chat_template 结果逐项比对，不一致则停用该组合的快速路径。
+        处理器调用持有 _processor_lock，批量预取线程与主线程不会同时使用分词器。
+
+        Args:
+            stream: 指定时在该 CUDA 流上执行拷贝（批量预取使用）
+        """
+        # 预处理同样在 inference_mode 中进行（预取线程里调用时也生效），
+        # 处理器和拷贝产生的张量不带版本计数与视图追踪
+        with torch.inference_mode():
+            with self._processor_lock:
+                fast_key = (prompt, len(image_items) > 1)
+                fast_ok = self._fast_inputs_ok.get(fast_key)
+                inputs = None
+                if fast_ok is not False:
+                    inputs = self._encode_fast(image_items, prompt)
+
+                if inputs is None or fast_ok is None:
+                    full_inputs = self._encode_full(image_items, prompt)
+                    if inputs is not None:
+                        fast_ok = self._same_inputs(inputs, full_inputs)
+                        self._fast_inputs_ok[fast_key] = fast_ok
+                        if not fast_ok:
+                            print(f"提示词缓存结果与处理器不一致，停用快速路径: {fast_key}")
+                    inputs = full_inputs
+
+            inputs.pop("token_type_ids", None)
+            if self._use_static_cache:
+                inputs = self._pad_to_bucket(inputs)
+            return self._to_device(inputs, stream)
+
+    def _encode_full(self, image_items: List[Dict], prompt: str):
+        """完整路径：apply_chat_template 渲染模板、分词并处理图片"""
+        conversations = [
+            [
+                {
+                    "role": "user",
+                    "content": [
+                        self._template_image_item(image_item),
+                        {
+                            "type": "text",
+                            "text": prompt
+                        }
+                    ],
+                }
+            ]
+            for image_item in image_items
+        ]
+
+        template_kwargs = dict(
+            tokenize=True,
+            add_generation_prompt=True,
+            return_dict=True,
+            return_tensors="pt"
+        )
+        batched = len(conversations) > 1
+        if batched:
+            template_kwargs["padding"] = True
+        else:
+            conversations = conversations[0]
+
+        tokenizer = self.processor.tokenizer if batched else None
+        if tokenizer is not None:
+            # 生成式模型批处理需左侧填充，保证每行的新 token 都从同一位置开始
+            padding_side = tokenizer.padding_side
+            tokenizer.padding_side = "left"
+        try:
+            return self.processor.apply_chat_template(
+                conversations,
+                **template_kwargs
+            )
+        finally:
+            if tokenizer is not None:
+                tokenizer.padding_side = padding_side
+
+    def _prompt_template(self, prompt: str):
+        """
+        渲染并分词只含图片占位符的对话模板，按提示词缓存。
+
+        Returns:
+            (prefix_ids, suffix_ids, image_token_id, merge_length)；
+            处理器不符合快速路径的要求时为 None
+        """
+        try:
+            return self._prompt_templates[prompt]
+        except KeyError:
+            pass
+
+        template = None
+        image_token = getattr(self.processor, "image_token", None)
+        merge_size = getattr(self.processor.image_processor, "merge_size", None)
+        tokenizer = getattr(self.processor, "tokenizer", None)
+        if image_token and merge_size and tokenizer is not None:
+            text = self.processor.apply_chat_template(
+                [{"role": "user", "content": [{"type": "image"}, {"type": "text", "text": prompt}]}],
+                tokenize=False,
+                add_generation_prompt=True
+            )
+            ids = tokenizer(text, add_special_tokens=False)["input_ids"]
+            image_token_id = tokenizer.convert_tokens_to_ids(image_token)
+            if ids.count(image_token_id) == 1:
+                pos = ids.index(image_token_id)
+                template = (ids[:pos], ids[pos + 1:], image_token_id, merge_size ** 2)
+
+        self._prompt_templates[prompt] = template
+        return template
+
+    def _encode_fast(self, image_items: List[Dict], prompt: str):
+        """
+        快速路径：提示词部分的 token 来自缓存，图像处理器输出按图片内容缓存，
+        再按图片网格大小展开图片占位 token。不适用时返回 None。
+        """
+        try:
+            template = self._prompt_template(prompt)
+            if template is None:
+                return None
+            prefix_ids, suffix_ids, image_token_id, merge_length = template
+
+            # 逐张取图像处理器输出（命中缓存时跳过解码和预处理），再按批拼接
+            per_image = [self._process_image(item) for item in image_items]
+            if len(per_image) == 1:
+                image_inputs = dict(per_image[0])
+            else:
+                image_inputs = {
+                    key: torch.cat([outputs[key] for outputs in per_image])
+                    for key in per_image[0]
+                }
+            rows = [
+                prefix_ids + [image_token_id] * (int(grid.prod()) // merge_length) + suffix_ids
+                for grid in image_inputs["image_grid_thw"]
+            ]
+
+            pad_token_id = self.processor.tokenizer.pad_token_id
+            if len(rows) > 1 and pad_token_id is None:
+                return None
+            max_len = max(len(row) for row in rows)
+            input_ids = torch.full((len(rows), max_len), pad_token_id or 0, dtype=torch.long)
+            attention_mask = torch.zeros((len(rows), max_len), dtype=torch.long)
+            for r, row in enumerate(rows):
+                # 左侧填充，与批量完整路径一致
+                input_ids[r, max_len - len(row):] = torch.tensor(row, dtype=torch.long)
+                attention_mask[r, max_len - len(row):] = 1
+
+            return BatchFeature(data={
+                "input_ids": input_ids,
+                "attention_mask": attention_mask,
+                **image_inputs
+            })
+        except Exception as e:
+            print(f"提示词缓存路径失败，停用快速路径: {e}")
+            self._fast_inputs_ok[(prompt, len(image_items) > 1)] = False
+            return None
+
+    @staticmethod
+    def _image_cache_key(item: Dict) -> tuple:
+        """
+        图像处理器输出缓存的键
+
+        文件（包括由文件解码出的内存图片）按路径 + 修改时间 + 大小，不读取、不哈希像素；
+        其他内存图片（如剪贴板截图）按尺寸、模式和整幅像素哈希，每次调用只哈希一次，
+        同一个键既用于查找也用于写入
+        """
+        path = item.get("source", item.get("url"))
+        if path is not None:
+            st = os.stat(path)
+            return path, st.st_mtime_ns, st.st_size
+        img = item["image"]
+        return img.mode, img.size, hashlib.blake2b(img.tobytes(), digest_size=16).digest()
+
+    def _process_image(self, item: Dict) -> Dict[str, torch.Tensor]:
+        """
+        运行图像处理器处理单张图片，结果按内容缓存（LRU，总大小不超过 IMAGE_CACHE_BYTES），
+        同一图片换提示词重新识别时不再重复缩放、归一化和切 patch
+        """
+        key = self._image_cache_key(item)
+        cached = self._image_cache.get(key)
+        if cached is not None:
+            self._image_cache.move_to_end(key)
+            return cached
+
+        if "image" in item:
+            img = item["image"]
+        else:
+            with Image.open(item["url"]) as raw:
+                img = ImageOps.exif_transpose(raw).convert("RGB")
+
+        outputs = dict(self.processor.image_processor(images=[img], return_tensors="pt"))
+        nbytes = self._tensor_bytes(outputs)
+        if nbytes <= self.IMAGE_CACHE_BYTES:
+            self._image_cache[key] = outputs
+            self._image_cache_bytes += nbytes
+            while self._image_cache_bytes > self.IMAGE_CACHE_BYTES:
+                _, evicted = self._image_cache.popitem(last=False)
+                self._image_cache_bytes -= self._tensor_bytes(evicted)
+        return outputs
+
+    @staticmethod
+    def _tensor_bytes(outputs: Dict) -> int:
+        """处理器输出中张量占用的总字节数"""
+        return sum(value.nbytes for value in outputs.values() if isinstance(value, torch.Tensor))
+
+    @staticmethod
+    def _same_inputs(fast, full) -> bool:
+        """比较快速路径与完整路径生成的输入是否完全一致"""
+        keys = set(full.keys()) - {"token_type_ids"}
+        if set(fast.keys()) != keys:
+            return False
+        for key in keys:
+            a, b = fast[key], full[key]
+            if isinstance(b, torch.Tensor):
+                if not isinstance(a, torch.Tensor) or a.shape != b.shape or not torch.equal(a, b.to(a.dtype)):
+                    return False
+            elif a != b:
+                return False
+        return True
+
+    def _to_device(self, inputs, stream=None):
+        """
+        将输入张量移动到模型设备。
+
+        CUDA 上先放入锁页内存再异步拷贝，拷贝与 CPU 侧后续工作重叠；
+        未指定 stream 时在默认流上拷贝，generate 天然排在拷贝之后，无需显式同步；
+        指定 stream 时由调用方通过 _wait_for_inputs 同步。
+        """
+        device = self.model.device
+        if device.type != "cuda":
+            return inputs.to(device)
+
+        with torch.cuda.stream(stream) if stream is not None else contextlib.nullcontext():
+            for key, value in inputs.items():
+                if isinstance(value, torch.Tensor):
+                    inputs[key] = value.pin_memory().to(device, non_blocking=True)
+        return inputs
+
+    def _prepare_inputs(self, prepared: Union[str, Image.Image], prompt: str, source=None):
+        """
+        将预处理后的图片构建为模型输入
+
+        内存中的图片直接交给处理器，避免 PNG 编码 + 磁盘读写；
+        处理器不接受 PIL Image 时退回内存中编码的 data URL。
+        """
+        if isinstance(prepared, Image.Image) and self._pil_input_supported is None:
+            try:
+                inputs = self._build_inputs([self._image_item(prepared, source)], prompt)
+                self._pil_input_supported = True
+                return inputs
+            except (TypeError, ValueError, KeyError, AttributeError) as e:
+                print(f"处理器不支持内存图片输入，改用 data URL: {e}")
+                self._pil_input_supported = False
+
+        return self._build_inputs([self._image_item(prepared, source)], prompt)
+
     def recognize_image(
         self,
         image: Union[str, Path, Image.Image],
         prompt: str = "Text Recognition:",
-        max_new_tokens: int = 2048
+        max_new_tokens: int = 2048,
+        stream_callback=None,
+        stream_reset=None
     ) -> Optional[str]:
         """
         识别单张图片
@@ -184,6 +841,10 @@ class OCREngine:
             image: 图片路径或 PIL Image 对象
             prompt: 识别提示词
             max_new_tokens: 最大生成 token 数
+            stream_callback: 流式回调 callback(text: str)，生成过程中逐段传入新文本；
+                返回值仍为完整的识别结果
+            stream_reset: 已流式输出的文本作废时调用（显存不足改为非流式重试前），
+                调用方应清除已显示的部分文本
 
         Returns:
             识别结果文本，失败返回 None
@@ -191,125 +852,260 @@ class OCREngine:
         if not self._is_loaded:
             raise RuntimeError("模型未加载，请先调用 load_model()")
 
-        temp_path = None
         try:
             # 预处理图片（限制超大图片尺寸）
-            image_url = self._prepare_image(image)
-            if isinstance(image, Image.Image):
-                import os
-                temp_path = image_url  # 记录临时文件以便清理
-
-            # 按官方文档构建消息
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "url": image_url
-                        },
-                        {
-                            "type": "text",
-                            "text": prompt
-                        }
-                    ],
-                }
-            ]
+            prepared = self._prepare_image(image)
 
             # 处理输入
-            inputs = self.processor.apply_chat_template(
-                messages,
-                tokenize=True,
-                add_generation_prompt=True,
-                return_dict=True,
-                return_tensors="pt"
-            ).to(self.model.device)
+            inputs = self._prepare_inputs(prepared, prompt, image)
 
-            inputs.pop("token_type_ids", None)
-
-            # 关闭梯度计算，减少显存占用
+            # 从生成到解码整个过程都在 inference_mode 中，避免任何 autograd 记录
             with torch.inference_mode():
-                generated_ids = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
+                max_new_tokens = self._token_budget(inputs, max_new_tokens)
+                try:
+                    if stream_callback is not None:
+                        generated_ids = self._generate_streaming(inputs, max_new_tokens, stream_callback)
+                    else:
+                        generated_ids = self._run_generate(inputs, max_new_tokens)
+                except torch.cuda.OutOfMemoryError:
+                    # 显存不足时才释放缓存并重试一次；正常路径不做 empty_cache，
+                    # 避免每张图片都触发设备同步和显存块的重新分配。
+                    # 重试时生成上限减半，降低 KV cache 的峰值占用；重试不再流式输出
+                    max_new_tokens = max(1, max_new_tokens // 2)
+                    print(f"显存不足，释放缓存后以 max_new_tokens={max_new_tokens} 重试...")
+                    if stream_callback is not None and stream_reset is not None:
+                        stream_reset()
+                    self._release_memory()
+                    generated_ids = self._run_generate(inputs, max_new_tokens)
 
-            # 解码输出
-            input_len = inputs["input_ids"].shape[1]
-            output_text = self.processor.decode(
-                generated_ids[0][input_len:],
-                skip_special_tokens=True
-            )
+                # 解码输出：只把新生成的 token 拷回 CPU，不连带提示词部分
+                input_len = inputs["input_ids"].shape[1]
+                new_tokens = generated_ids[0, input_len:].tolist()
+                with self._processor_lock:
+                    output_text = self.processor.decode(
+                        new_tokens,
+                        skip_special_tokens=True
+                    )
 
             # 立即释放中间张量
             del inputs, generated_ids
 
-            # 强制回收内存，防止碎片累积
-            gc.collect()
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-
             return output_text
 
         except Exception as e:
             print(f"识别失败: {e}")
-            import traceback
             traceback.print_exc()
             return None
-        finally:
-            # 清理临时文件
-            if temp_path:
-                try:
-                    import os
-                    os.remove(temp_path)
-                except OSError:
-                    pass
 
     def recognize_batch(
         self,
         images: List[Union[str, Path, Image.Image]],
         prompt: str = "Text Recognition:",
         max_new_tokens: int = 2048,
-        progress_callback=None
+        progress_callback=None,
+        batch_size: int = 4
     ) -> List[Dict[str, Union[str, bool]]]:
         """
         批量识别图片
 
+        尺寸相近的图片（最多 batch_size 张）拼成一个批次调用一次 generate，
+        分摊启动开销；批次推理失败时该批次退回逐张识别。
+        结果按输入顺序返回，进度按完成数量回调。
+
         Args:
             images: 图片路径或对象列表
             prompt: 识别提示词
             max_new_tokens: 最大生成 token 数
             progress_callback: 进度回调 callback(current: int, total: int, result: str)
+            batch_size: 每批图片数量，1 表示逐张识别
 
         Returns:
             识别结果列表 [{"image": path, "text": result, "success": bool}, ...]
         """
-        results = []
         total = len(images)
+        results: List[Optional[Dict[str, Union[str, bool]]]] = [None] * total
+        done = 0
 
-        for i, image in enumerate(images):
-            try:
-                image_path = str(image) if isinstance(image, (str, Path)) else "clipboard"
-                text = self.recognize_image(image, prompt, max_new_tokens)
+        groups = self._group_by_area(images, max(1, batch_size))
 
-                results.append({
-                    "image": image_path,
-                    "text": text if text else "",
-                    "success": text is not None
-                })
+        def prefetch(k):
+            """在预取线程中准备第 k 批的输入（包括只有一张图片的批次）"""
+            if k >= len(groups):
+                return None
+            return prefetcher.submit(
+                self._build_chunk_inputs, [images[i] for i in groups[k]], prompt
+            )
 
-                if progress_callback:
-                    progress_callback(i + 1, total, text if text else "识别失败")
+        # 单线程预取：GPU 生成第 k 批时，CPU 同时解码、预处理第 k+1 批并在拷贝流上传输；
+        # batch_size=1 时每张图片的解码同样与上一张的生成重叠
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            pending = prefetch(0)
+            for k, chunk in enumerate(groups):
+                current, pending = pending, prefetch(k + 1)
 
-            except Exception as e:
-                results.append({
-                    "image": str(image) if isinstance(image, (str, Path)) else "unknown",
-                    "text": f"错误: {str(e)}",
-                    "success": False
-                })
+                batch_texts = None
+                if current is not None:
+                    batch_texts = self._generate_chunk(current.result(), max_new_tokens)
+
+                for offset, i in enumerate(chunk):
+                    image = images[i]
+                    done += 1
+                    try:
+                        image_path = str(image) if isinstance(image, (str, Path)) else "clipboard"
+                        if batch_texts is not None:
+                            text = batch_texts[offset]
+                        else:
+                            text = self.recognize_image(image, prompt, max_new_tokens)
+
+                        results[i] = {
+                            "image": image_path,
+                            "text": text if text else "",
+                            "success": text is not None
+                        }
+
+                        if progress_callback:
+                            progress_callback(done, total, text if text else "识别失败")
+
+                    except Exception as e:
+                        results[i] = {
+                            "image": str(image) if isinstance(image, (str, Path)) else "unknown",
+                            "text": f"错误: {str(e)}",
+                            "success": False
+                        }
 
-                if progress_callback:
-                    progress_callback(i + 1, total, f"错误: {str(e)}")
+                        if progress_callback:
+                            progress_callback(done, total, f"错误: {str(e)}")
+
+        # 整批结束后统一回收一次内存
+        self._release_memory()
 
         return results
 
+    @staticmethod
+    def _image_area(image: Union[str, Path, Image.Image]) -> int:
+        """获取图片像素面积（路径只读取文件头），读取失败返回 0"""
+        if isinstance(image, Image.Image):
+            return image.width * image.height
+        try:
+            with Image.open(str(image)) as img:
+                return img.width * img.height
+        except Exception:
+            return 0
+
+    def _group_by_area(
+        self,
+        images: List[Union[str, Path, Image.Image]],
+        batch_size: int
+    ) -> List[List[int]]:
+        """
+        按面积对图片分组，返回每批的原始下标。
+
+        尺寸相近的图片放在同一批，批内最大/最小面积比超过
+        MAX_BATCH_AREA_RATIO 时另起一批，控制填充带来的无效计算。
+        """
+        if batch_size == 1:
+            return [[i] for i in range(len(images))]
+
+        areas = [self._image_area(image) for image in images]
+        order = sorted(range(len(images)), key=areas.__getitem__)
+
+        groups: List[List[int]] = []
+        for i in order:
+            if (groups and len(groups[-1]) < batch_size
+                    and areas[i] <= max(areas[groups[-1][0]], 1) * self.MAX_BATCH_AREA_RATIO):
+                groups[-1].append(i)
+            else:
+                groups.append([i])
+        return groups
+
+    def _build_chunk_inputs(self, images: List[Union[str, Path, Image.Image]], prompt: str):
+        """
+        在预取线程中为一批图片构建模型输入
+
+        CUDA 上输入在独立的拷贝流上传输，并记录事件供 generate 前等待。
+
+        Returns:
+            (inputs, ready_event)；非 CUDA 时 ready_event 为 None；
+            无法批量处理时返回 None，由调用方逐张识别
+        """
+        if not self._is_loaded or getattr(self.processor, "tokenizer", None) is None:
+            return None
+
+        try:
+            prepared = [self._prepare_image(image) for image in images]
+            stream = self._get_copy_stream()
+            inputs = self._build_inputs(
+                [self._image_item(p, image) for p, image in zip(prepared, images)], prompt, stream
+            )
+            ready_event = None
+            if stream is not None:
+                ready_event = torch.cuda.Event()
+                ready_event.record(stream)
+            return inputs, ready_event
+        except Exception as e:
+            print(f"批量预处理失败，改为逐张识别: {e}")
+            return None
+
+    def _get_copy_stream(self):
+        """批量预取使用的 CUDA 拷贝流（首次使用时创建），非 CUDA 返回 None"""
+        if self.model.device.type != "cuda":
+            return None
+        if self._copy_stream is None:
+            self._copy_stream = torch.cuda.Stream(device=self.model.device)
+        return self._copy_stream
+
+    @staticmethod
+    def _wait_for_inputs(inputs, ready_event):
+        """让当前流等待拷贝流上的传输完成，并登记张量在当前流上使用"""
+        if ready_event is None:
+            return
+        current = torch.cuda.current_stream()
+        current.wait_event(ready_event)
+        for value in inputs.values():
+            if isinstance(value, torch.Tensor) and value.is_cuda:
+                # 防止缓存分配器在当前流用完之前把显存块复用给拷贝流
+                value.record_stream(current)
+
+    def _generate_chunk(self, prepared_inputs, max_new_tokens: int) -> Optional[List[str]]:
+        """
+        一次 generate 识别一批图片
+
+        Args:
+            prepared_inputs: _build_chunk_inputs 的返回值
+
+        Returns:
+            与该批图片一一对应的识别文本；无法批量处理时返回 None，由调用方逐张识别
+        """
+        if prepared_inputs is None:
+            return None
+
+        inputs, ready_event = prepared_inputs
+        try:
+            self._wait_for_inputs(inputs, ready_event)
+
+            with torch.inference_mode():
+                max_new_tokens = self._token_budget(inputs, max_new_tokens)
+                generated_ids = self._run_generate(inputs, max_new_tokens)
+
+                input_len = inputs["input_ids"].shape[1]
+                new_tokens = generated_ids[:, input_len:].tolist()
+                with self._processor_lock:
+                    texts = self.processor.batch_decode(
+                        new_tokens,
+                        skip_special_tokens=True
+                    )
+
+            del inputs, generated_ids
+            return texts
+
+        except torch.cuda.OutOfMemoryError:
+            print("批量推理显存不足，释放缓存后改为逐张识别")
+            self._release_memory()
+            return None
+        except Exception as e:
+            print(f"批量推理失败，改为逐张识别: {e}")
+            return None
+
     def unload_model(self):
         """卸载模型释放内存"""
         if self._is_loaded:
@@ -317,23 +1113,25 @@ class OCREngine:
             del self.processor
             self.model = None
             self.processor = None
+            self._copy_stream = None
+            if self._generate_executor is not None:
+                self._generate_executor.shutdown(wait=True)
+                self._generate_executor = None
+            self._image_cache.clear()
+            self._image_cache_bytes = 0
             self._is_loaded = False
 
             # 强制回收 Python 对象和 CUDA 显存
             gc.collect()
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
+                torch.cuda.ipc_collect()
 
             print("✓ 模型已卸载")
 
-    def get_supported_prompts(self) -> Dict[str, str]:
-        """获取支持的提示词类型"""
-        return {
-            "text_recognition": "Text Recognition:",
-            "document_parsing": "Document Parsing:",
-            "table_recognition": "Table Recognition:",
-            "formula_recognition": "Formula Recognition:"
-        }
+    def get_supported_prompts(self) -> Mapping[str, str]:
+        """获取支持的提示词类型（只读映射）"""
+        return self._SUPPORTED_PROMPTS
 
     def get_model_info(self) -> Dict[str, str]:
         """获取模型信息"""
@@ -346,5 +1144,9 @@ class OCREngine:
             "device": str(self.model.device),
             "dtype": str(self.model.dtype) if hasattr(self.model, 'dtype') else "unknown",
             "mode": "仅本地" if self.use_local_only else "在线/本地",
-            "quantization": self.quantization
+            "quantization": self.quantization,
+            "compile": self.compile_mode if self._use_static_cache else "off",
+            "cuda_graphs": "on" if (self._use_static_cache
+                                    and self.compile_mode in self.CUDA_GRAPH_COMPILE_MODES) else "off",
+            "attn_implementation": self.attn_impl
         }
@@ -1,11 +1,80 @@
 """
 模型导出工具
-将 HuggingFace 缓存中的模型复制到指定目录
+将 HuggingFace 缓存中的模型复制到指定目录（同一文件系统上使用 reflink / 硬链接）
 """
+import os
+import sys
 import shutil
+import subprocess
 from pathlib import Path
 
 
+def _clone_file(src: Path, dst: Path) -> str:
+    """
+    以最省空间的方式复制单个文件
+
+    依次尝试：写时复制 reflink（btrfs/XFS，仅 Linux）→ 硬链接 → 完整复制。
+
+    Returns:
+        使用的方式："reflink" / "hardlink" / "copy"
+    """
+    if sys.platform.startswith("linux"):
+        result = subprocess.run(
+            ["cp", "--reflink=always", str(src), str(dst)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        if result.returncode == 0:
+            return "reflink"
+
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        # 跨文件系统或文件系统不支持硬链接
+        shutil.copy2(src, dst)
+        return "copy"
+
+
+def _link_tree(src: Path, dst: Path) -> dict:
+    """
+    用 reflink / 硬链接代替 copytree 导出目录，同一文件系统上几乎不复制任何数据
+
+    注意：硬链接的文件与 HuggingFace 缓存共享 inode，不要原地修改导出的模型文件。
+    HuggingFace 快照中的文件是指向 blobs 的符号链接，这里链接的是其实际文件。
+
+    Returns:
+        各方式处理的文件数 {"reflink": n, "hardlink": n, "copy": n}
+    """
+    counts = {"reflink": 0, "hardlink": 0, "copy": 0}
+    dst.mkdir(parents=True, exist_ok=True)
+    for src_path in src.rglob("*"):
+        dst_path = dst / src_path.relative_to(src)
+        if src_path.is_dir():
+            dst_path.mkdir(parents=True, exist_ok=True)
+        elif src_path.is_file():
+            dst_path.parent.mkdir(parents=True, exist_ok=True)
+            counts[_clone_file(src_path.resolve(), dst_path)] += 1
+    return counts
+
+
+def _dir_size(path) -> int:
+    """
+    递归统计目录下文件总大小
+
+    使用 os.scandir：DirEntry 在列目录时已带有文件类型，
+    Windows 上 stat 结果也直接来自目录列表，无需逐个文件再做系统调用。
+    """
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                total += _dir_size(entry.path)
+            elif entry.is_file():
+                total += entry.stat().st_size
+    return total
+
+
 def export_model(output_dir="./models/GLM-OCR"):
     """
     导出模型到指定目录
@@ -52,10 +121,11 @@ def export_model(output_dir="./models/GLM-OCR"):
         print("删除旧目录...")
         shutil.rmtree(output_path)
 
-    # 复制文件
+    # 复制文件（优先 reflink / 硬链接）
     print("\n开始复制模型文件...")
     try:
-        shutil.copytree(snapshot, output_path)
+        counts = _link_tree(snapshot, output_path)
+        print(f"reflink: {counts['reflink']}  硬链接: {counts['hardlink']}  复制: {counts['copy']}")
 
         # 验证关键文件
         required_files = [
@@ -68,11 +138,11 @@ def export_model(output_dir="./models/GLM-OCR"):
         print("\n验证文件:")
         all_ok = True
         for filename in required_files:
-            file_path = output_path / filename
-            if file_path.exists():
-                size_mb = file_path.stat().st_size / (1024 * 1024)
+            # 一次 stat 同时完成存在性检查和大小读取
+            try:
+                size_mb = os.stat(output_path / filename).st_size / (1024 * 1024)
                 print(f"  ✓ {filename:30} ({size_mb:.2f} MB)")
-            else:
+            except OSError:
                 print(f"  ✗ {filename:30} (缺失)")
                 all_ok = False
 
@@ -83,7 +153,7 @@ def export_model(output_dir="./models/GLM-OCR"):
             print(f"\n模型位置: {output_path.absolute()}")
 
             # 计算总大小
-            total_size = sum(f.stat().st_size for f in output_path.rglob("*") if f.is_file())
+            total_size = _dir_size(output_path)
             print(f"总大小: {total_size / (1024 ** 3):.2f} GB")
 
             print("\n现在可以:")
@@ -244,7 +314,7 @@ python3 main.py
     print(f"\n位置: {package_dir.absolute()}")
 
     # 计算总大小
-    total_size = sum(f.stat().st_size for f in package_dir.rglob("*") if f.is_file())
+    total_size = _dir_size(package_dir)
     print(f"大小: {total_size / (1024 ** 3):.2f} GB")
 
     print("\n现在可以:")
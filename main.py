@@ -4,7 +4,10 @@ GLM-OCR GUI 主程序入口
 import sys
 from pathlib import Path
 import os
-os.environ["TORCH_DISABLE_TORCH_NP"] = "1"
+# 打包版通过 exe.py 的 --exclude-module=torch._numpy 排除了该模块，需同时禁用其加载；
+# 开发环境保留 torch._numpy，torch.compile 追踪时可能用到
+if getattr(sys, 'frozen', False):
+    os.environ.setdefault("TORCH_DISABLE_TORCH_NP", "1")
 # 减少 CUDA 显存碎片化
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
 # ok ok
@@ -17,6 +20,9 @@ else:
     # 开发环境：脚本所在目录
     BASE_DIR = Path(__file__).parent
 
+# torch.compile 编译产物缓存到程序目录，再次启动时复用，省去重复编译
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(BASE_DIR / ".torchinductor_cache"))
+
 # 添加项目根目录到 Python 路径
 sys.path.insert(0, str(BASE_DIR))
 
@@ -5,19 +5,79 @@
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
 from pathlib import Path
+import os
 import threading
+import queue
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import io
 
+# PIL 已由 OCREngine 导入，这里直接在模块级引用
+from PIL import Image, ImageTk
+
 from core.Config import Config
 from core.OCREngine import OCREngine
 from utils.FileUtils import FileUtils
 from utils.ClipboardUtils import ClipboardUtils
 from utils.QRCodeUtils import QRCodeUtils
 
+# 识别类型（界面选项）到模型提示词的映射
+PROMPT_MAP = {
+    "文本识别": "Text Recognition:",
+    "文档解析": "Document Parsing:",
+    "表格识别": "Table Recognition:",
+    "公式识别": "Formula Recognition:"
+}
+
+# 文件对话框的类型过滤
+IMAGE_FILETYPES = (
+    ("图片文件", "*.png *.jpg *.jpeg *.bmp *.gif *.webp"),
+    ("所有文件", "*.*")
+)
+QR_SAVE_FILETYPES = (("PNG 图片", "*.png"), ("WebP 图片", "*.webp"), ("JPEG 图片", "*.jpg"))
+
+# qrcode 为可选依赖，首次生成二维码时才导入
+_qrcode = None
+
+
+def _get_qrcode():
+    """返回 qrcode 模块（首次调用时导入并缓存），未安装时抛出 ImportError"""
+    global _qrcode
+    if _qrcode is None:
+        import qrcode
+        _qrcode = qrcode
+    return _qrcode
+
 
 class MainWindow(ctk.CTk):
     """主窗口类"""
 
+    # 工作线程提交的界面更新：主线程每隔 UI_QUEUE_INTERVAL_MS 毫秒处理一次，
+    # 每次最多 UI_QUEUE_BATCH 条，避免积压时长时间占用事件循环
+    UI_QUEUE_INTERVAL_MS = 30
+    UI_QUEUE_BATCH = 200
+
+    # 批量识别进度刷新的最小间隔（秒），约 20 次/秒
+    PROGRESS_INTERVAL = 0.05
+
+    # 日志区最多保留的行数；超出时从头部删除，删到剩 LOG_MAX_LINES - LOG_TRIM_LINES 行
+    LOG_MAX_LINES = 5000
+    LOG_TRIM_LINES = 1000
+
+    # 批量识别结果并行保存的线程数
+    SAVE_WORKERS = 4
+
+    # 切换识别类型后延迟记录日志的时间（毫秒），连续切换只记录最后一次
+    PROMPT_LOG_DELAY_MS = 250
+
+    # 单图预览的最大尺寸
+    PREVIEW_SIZE = (600, 200)
+
+    # 缓存的文件预览图数量
+    PREVIEW_CACHE_SIZE = 8
+
     def __init__(self, base_dir=None):
         super().__init__()
 
@@ -40,6 +100,19 @@ class MainWindow(ctk.CTk):
         # 动态 Token 设置
         self.current_tokens = self.config.get("model.max_new_tokens", 2048)
 
+        # 界面更新队列（Tk 不是线程安全的，工作线程只能通过队列更新控件）
+        self._ui_queue = queue.Queue()
+        # 待写入日志区的行，随界面更新队列每个周期一次性写入
+        self._log_pending = deque(maxlen=self.LOG_MAX_LINES)
+        self._log_lock = threading.Lock()
+        # 图片预览在后台线程解码、缩放；序号用于丢弃过期的预览结果
+        self._preview_executor = ThreadPoolExecutor(max_workers=2)
+        self._preview_seq = 0
+        # 文件预览缓存：(路径, 修改时间) -> PhotoImage，按最近使用顺序淘汰
+        self._preview_cache = OrderedDict()
+        # 同一时间只允许一个识别任务使用模型
+        self._ocr_lock = threading.Lock()
+
         # UI 初始化
         self.setup_window()
         self.create_widgets()
@@ -47,6 +120,9 @@ class MainWindow(ctk.CTk):
         # 绑定快捷键
         self.bind_shortcuts()
 
+        # 启动界面更新队列的处理循环
+        self.after(self.UI_QUEUE_INTERVAL_MS, self._drain_ui_queue)
+
     def setup_window(self):
         """设置窗口"""
         self.title("GLM-OCR GUI")
@@ -183,6 +259,7 @@ class MainWindow(ctk.CTk):
             command=self.on_prompt_change
         )
         self.prompt_type.grid(row=0, column=1, padx=5, pady=10, sticky="w")
+        self._prompt_after_id = None
 
         # Token 调整控件
         # Token 标签
@@ -347,8 +424,10 @@ class MainWindow(ctk.CTk):
         self.progress_bar.grid(row=4, column=0, padx=10, pady=(5, 10), sticky="ew")
         self.progress_bar.set(0)
 
-        # 批量文件列表
-        self.batch_files = []
+        # 批量文件列表：按添加顺序保存的路径（dict 用作有序集合）
+        self.batch_files = {}
+        # 规范化后的路径集合，用于 O(1) 去重（Windows 上不区分大小写和斜杠方向）
+        self._batch_keys = set()
 
     def create_qrgen_tab(self):
         """创建二维码生成标签页"""
@@ -395,6 +474,8 @@ class MainWindow(ctk.CTk):
 
         # 保存生成的二维码 PIL Image
         self._qr_image = None
+        # 当前预览对应的文本，内容未变时不重新生成
+        self._qr_text = None
 
     def generate_qrcode(self):
         """根据输入文本生成二维码"""
@@ -403,22 +484,30 @@ class MainWindow(ctk.CTk):
             messagebox.showwarning("警告", "请输入要生成二维码的内容")
             return
 
-        try:
-            import qrcode
-            from PIL import ImageTk
+        # 内容与当前预览相同：图片已是最新，无需重新编码和绘制
+        if text == self._qr_text and self._qr_image is not None:
+            return
 
-            qr = qrcode.QRCode(box_size=10, border=4)
+        try:
+            qr = _get_qrcode().QRCode(box_size=10, border=4)
             qr.add_data(text)
             qr.make(fit=True)
-            self._qr_image = qr.make_image(fill_color="black", back_color="white").convert("RGB")
+            # 二维码只有黑白两色，保持 1 位（mode "1"）图像，内存和保存的文件都小得多
+            qr_image = qr.make_image(fill_color="black", back_color="white")
+            if hasattr(qr_image, "get_image"):
+                self._qr_image = qr_image.get_image()
+            else:
+                # 旧版 qrcode 没有 get_image，转换得到普通 PIL Image
+                self._qr_image = qr_image.convert("1")
 
-            # 缩放到预览尺寸
-            preview = self._qr_image.copy()
+            # 预览用灰度副本缩放，保留抗锯齿
+            preview = self._qr_image.convert("L")
             preview.thumbnail((380, 380))
 
             tk_image = ImageTk.PhotoImage(preview)
             self.qr_preview_label.configure(image=tk_image, text="")
             self.qr_preview_label._tk_image = tk_image  # 防止被 GC 回收
+            self._qr_text = text
 
             self.log(f"✓ 二维码已生成: {text[:50]}{'...' if len(text) > 50 else ''}")
         except ImportError:
@@ -436,12 +525,34 @@ class MainWindow(ctk.CTk):
         file_path = filedialog.asksaveasfilename(
             title="保存二维码",
             defaultextension=".png",
-            filetypes=[("PNG 图片", "*.png"), ("JPEG 图片", "*.jpg")]
+            filetypes=QR_SAVE_FILETYPES
         )
 
         if file_path:
-            self._qr_image.save(file_path)
+            # 在后台线程编码写盘，界面不等待磁盘
+            threading.Thread(
+                target=self._save_qr_image,
+                args=(self._qr_image, file_path),
+                daemon=True
+            ).start()
+
+    def _save_qr_image(self, image, file_path: str):
+        """按扩展名选择压缩参数保存二维码图片（在后台线程运行）"""
+        suffix = Path(file_path).suffix.lower()
+        if suffix == ".png":
+            save_kwargs = {"optimize": True}
+        elif suffix == ".webp":
+            # 二维码只有黑白两色，无损 WebP 体积更小且不失真
+            save_kwargs = {"lossless": True, "method": 4}
+        else:
+            save_kwargs = {}
+
+        try:
+            image.save(file_path, **save_kwargs)
             self.log(f"✓ 二维码已保存: {file_path}")
+        except Exception as e:
+            self.log(f"✗ 二维码保存失败: {e}")
+            self._run_on_ui(messagebox.showerror, "错误", f"保存失败: {e}")
 
     def create_log_tab(self):
         """创建日志标签页"""
@@ -479,20 +590,32 @@ class MainWindow(ctk.CTk):
 
         def load_thread():
             self.log("开始加载模型...")
-            self.btn_load_model.configure(state="disabled", text="加载中...")
-            quantization = self.config.get("model.quantization", "none")
+            self._run_on_ui(self.btn_load_model.configure, state="disabled", text="加载中...")
+            quantization = self.config.get("model.quantization", "auto")
+            compile_model = self.config.get("model.compile_model", True)
+            compile_mode = self.config.get("model.compile_mode", "reduce-overhead")
+            torch_dtype = self.config.get("model.torch_dtype", "auto")
+            attn_impl = self.config.get("model.attn_implementation", "auto")
             if self.config.get("model.use_local_only"):
                 self.ocr_engine = OCREngine(
                     model_path=self.config.get("model.local_path"),
                     device=self.config.get("model.device"),
                     use_local_only=self.config.get("model.use_local_only"),
-                    quantization=quantization
+                    quantization=quantization,
+                    compile_model=compile_model,
+                    compile_mode=compile_mode,
+                    torch_dtype=torch_dtype,
+                    attn_impl=attn_impl
                 )
             else:
                 self.ocr_engine = OCREngine(
                     model_path=self.config.get("model.name"),
                     device=self.config.get("model.device"),
-                    quantization=quantization
+                    quantization=quantization,
+                    compile_model=compile_model,
+                    compile_mode=compile_mode,
+                    torch_dtype=torch_dtype,
+                    attn_impl=attn_impl
                 )
 
             success = self.ocr_engine.load_model(
@@ -501,25 +624,32 @@ class MainWindow(ctk.CTk):
 
             if success:
                 self.model_loaded = True
-                self.model_status_label.configure(text="模型已加载", text_color="green")
-                self.btn_load_model.configure(
+                self._run_on_ui(self.model_status_label.configure, text="模型已加载", text_color="green")
+                self._run_on_ui(
+                    self.btn_load_model.configure,
                     text="卸载模型",
                     fg_color="red",
                     state="normal"
                 )
                 self.log("✓ 模型加载成功")
             else:
-                self.model_status_label.configure(text="加载失败", text_color="red")
-                self.btn_load_model.configure(text="加载模型", state="normal")
+                self._run_on_ui(self.model_status_label.configure, text="加载失败", text_color="red")
+                self._run_on_ui(self.btn_load_model.configure, text="加载模型", state="normal")
                 self.log("✗ 模型加载失败")
 
         threading.Thread(target=load_thread, daemon=True).start()
 
     def unload_model(self):
-        """卸载模型"""
+        """卸载模型并释放引擎对象（显存回收由 OCREngine.unload_model 完成）"""
+        if self._ocr_lock.locked():
+            messagebox.showwarning("警告", "识别任务进行中，请完成后再卸载模型")
+            return
         if self.ocr_engine:
             self.ocr_engine.unload_model()
+        # 不再持有引擎引用
+        self.ocr_engine = None
         self.model_loaded = False
+        self.clear_previews()
         self.model_status_label.configure(text="模型未加载", text_color="red")
         self.btn_load_model.configure(text="加载模型", fg_color="green")
         self.log("模型已卸载")
@@ -532,6 +662,8 @@ class MainWindow(ctk.CTk):
 
     def clipboard_ocr(self):
         """剪贴板OCR"""
+        if self._ocr_busy():
+            return
         if not self.model_loaded:
             messagebox.showwarning("警告", "请先加载模型")
             return
@@ -559,36 +691,94 @@ class MainWindow(ctk.CTk):
 
     def quick_ocr(self):
         """快速OCR"""
+        if self._ocr_busy():
+            return
         if ClipboardUtils.has_image():
             self.clipboard_ocr()
         else:
             self.select_image()
 
+    def clear_previews(self):
+        """清除单图预览，释放预览图片"""
+        self._preview_seq += 1
+        self._preview_cache.clear()
+        self.image_label.configure(image=None, text="点击选择图片或粘贴图片\n支持拖拽图片到此处")
+        self.image_label._tk_image = None
+
     def show_image_preview(self, image):
-        """在预览区显示图片"""
-        from PIL import Image, ImageTk
+        """
+        在预览区显示图片
 
+        解码和缩放在后台线程完成，只有 PhotoImage 的创建和显示回到主线程；
+        连续预览多张图片时只显示最后一张。
+        文件按 (路径, 修改时间) 缓存最近 PREVIEW_CACHE_SIZE 张预览，重复预览无需再解码
+        """
+        self._preview_seq += 1
+        seq = self._preview_seq
+
+        cache_key = None
         if isinstance(image, (str, Path)):
-            pil_image = Image.open(str(image))
-        else:
-            pil_image = image
+            try:
+                cache_key = (str(image), os.stat(image).st_mtime_ns)
+            except OSError:
+                pass
+            tk_image = self._preview_cache.get(cache_key)
+            if tk_image is not None:
+                self._preview_cache.move_to_end(cache_key)
+                self._display_preview(tk_image)
+                return
+
+        future = self._preview_executor.submit(self._make_preview, image, self.PREVIEW_SIZE)
+        future.add_done_callback(lambda f: self._run_on_ui(self._apply_preview, seq, f, cache_key))
+
+    @staticmethod
+    def _make_preview(image, size):
+        """生成预览用的小图（在后台线程运行），不修改传入的图片"""
+        if isinstance(image, (str, Path)):
+            preview = Image.open(str(image))
+            # JPEG 直接按接近目标尺寸的比例解码，省去大部分解码工作
+            preview.draft("RGB", size)
+            # 缩放到预览区大小，保持比例；BILINEAR 比默认的 LANCZOS 快得多，预览足够清晰
+            preview.thumbnail(size, Image.Resampling.BILINEAR)
+            return preview
+
+        # 内存图片（如剪贴板截图）直接缩放出小图，不先复制整张原图
+        scale = min(size[0] / image.width, size[1] / image.height, 1.0)
+        return image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            Image.Resampling.BILINEAR,
+            reducing_gap=2.0
+        )
 
-        # 缩放到预览区大小，保持比例
-        preview = pil_image.copy()
-        preview.thumbnail((600, 200))
+    def _apply_preview(self, seq, future, cache_key=None):
+        """显示后台生成的预览图，并按 cache_key 缓存（仅主线程）"""
+        if seq != self._preview_seq:
+            return
+        try:
+            preview = future.result()
+        except Exception as e:
+            self.log(f"✗ 图片预览失败: {e}")
+            return
 
         tk_image = ImageTk.PhotoImage(preview)
+        if cache_key is not None:
+            self._preview_cache[cache_key] = tk_image
+            if len(self._preview_cache) > self.PREVIEW_CACHE_SIZE:
+                self._preview_cache.popitem(last=False)
+        self._display_preview(tk_image)
+
+    def _display_preview(self, tk_image):
+        """在预览区显示 PhotoImage（仅主线程）"""
         self.image_label.configure(image=tk_image, text="")
         self.image_label._tk_image = tk_image  # 防止 GC 回收
 
     def select_image(self):
         """选择图片"""
+        if self._ocr_busy():
+            return
         file_path = filedialog.askopenfilename(
             title="选择图片",
-            filetypes=[
-                ("图片文件", "*.png *.jpg *.jpeg *.bmp *.gif *.webp"),
-                ("所有文件", "*.*")
-            ]
+            filetypes=IMAGE_FILETYPES
         )
 
         if file_path:
@@ -611,7 +801,11 @@ class MainWindow(ctk.CTk):
             if is_qrcode_mode:
                 # 二维码识别模式
                 self.log("正在扫描二维码...")
-                qr_results = QRCodeUtils.decode_qrcodes(image)
+                try:
+                    qr_results = QRCodeUtils.decode_qrcodes(image)
+                except RuntimeError as e:
+                    self.log(f"✗ {e}")
+                    qr_results = []
                 qr_text = QRCodeUtils.format_results(qr_results)
 
                 if qr_text:
@@ -631,38 +825,54 @@ class MainWindow(ctk.CTk):
                         self.log("✓ 文字识别完成")
 
                 if output_parts:
-                    self.result_text.delete("1.0", "end")
-                    self.result_text.insert("1.0", "\n\n".join(output_parts))
+                    self._run_on_ui(self._show_result, "\n\n".join(output_parts))
                     self.log("✓ 识别完成")
                 else:
                     self.log("✗ 未检测到二维码或文字")
-                    messagebox.showinfo("提示", "未检测到二维码")
+                    self._run_on_ui(messagebox.showinfo, "提示", "未检测到二维码")
             else:
                 # 常规 OCR 模式
-                prompt_map = {
-                    "文本识别": "Text Recognition:",
-                    "文档解析": "Document Parsing:",
-                    "表格识别": "Table Recognition:",
-                    "公式识别": "Formula Recognition:"
-                }
-
-                prompt = prompt_map.get(self.prompt_type.get(), "Text Recognition:")
-
-                result = self.ocr_engine.recognize_image(
-                    image,
-                    prompt=prompt,
-                    max_new_tokens=self.current_tokens
-                )
+                prompt = PROMPT_MAP.get(self.prompt_type.get(), "Text Recognition:")
+
+                # 生成过程中逐段显示识别文本，完成后再以完整结果覆盖
+                self._run_on_ui(self._show_result, "")
+
+                def stream_callback(text):
+                    self._run_on_ui(self.result_text.insert, "end", text)
+
+                def stream_reset():
+                    self._run_on_ui(self._show_result, "")
+
+                try:
+                    result = self.ocr_engine.recognize_image(
+                        image,
+                        prompt=prompt,
+                        max_new_tokens=self.current_tokens,
+                        stream_callback=stream_callback,
+                        stream_reset=stream_reset
+                    )
+                except Exception:
+                    stream_reset()
+                    raise
 
                 if result:
-                    self.result_text.delete("1.0", "end")
-                    self.result_text.insert("1.0", result)
+                    self._run_on_ui(self._show_result, result)
                     self.log("✓ 识别完成")
                 else:
+                    # 清除失败前已流式显示的部分文本
+                    stream_reset()
                     self.log("✗ 识别失败")
-                    messagebox.showerror("错误", "识别失败")
+                    self._run_on_ui(messagebox.showerror, "错误", "识别失败")
+
+        if not self._begin_ocr():
+            return
+        threading.Thread(target=self._run_ocr_task, args=(recognize_thread,), daemon=True).start()
 
-        threading.Thread(target=recognize_thread, daemon=True).start()
+    def _show_result(self, text: str):
+        """用 text 替换结果区内容"""
+        self.result_text.delete("1.0", "end")
+        if text:
+            self.result_text.insert("1.0", text)
 
     def copy_result(self):
         """复制结果"""
@@ -677,18 +887,12 @@ class MainWindow(ctk.CTk):
         """添加批量文件"""
         files = filedialog.askopenfilenames(
             title="选择图片文件",
-            filetypes=[
-                ("图片文件", "*.png *.jpg *.jpeg *.bmp *.gif *.webp"),
-                ("所有文件", "*.*")
-            ]
+            filetypes=IMAGE_FILETYPES
         )
 
         if files:
-            for file in files:
-                if file not in self.batch_files:
-                    self.batch_files.append(file)
-            self.update_batch_list()
-            self.log(f"添加了 {len(files)} 个文件")
+            added = self._add_batch_paths(files)
+            self.log(f"添加了 {added} 个文件")
 
     def add_batch_folder(self):
         """添加文件夹"""
@@ -697,26 +901,46 @@ class MainWindow(ctk.CTk):
         if folder:
             recursive = self.recursive_var.get()
             files = FileUtils.get_images_from_directory(folder, recursive)
-
-            for file in files:
-                file_str = str(file)
-                if file_str not in self.batch_files:
-                    self.batch_files.append(file_str)
-
-            self.update_batch_list()
-            self.log(f"从文件夹添加了 {len(files)} 个文件")
+            added = self._add_batch_paths(files)
+            self.log(f"从文件夹添加了 {added} 个文件")
+
+    def _add_batch_paths(self, paths) -> int:
+        """
+        将新路径加入批量列表，文件列表只追加新增的部分
+
+        Returns:
+            实际新增的文件数
+        """
+        start = len(self.batch_files) + 1
+        new_files = []
+        for path in map(str, paths):
+            key = os.path.normcase(os.path.normpath(path))
+            if key not in self._batch_keys:
+                self._batch_keys.add(key)
+                new_files.append(path)
+        if new_files:
+            self.batch_files.update(dict.fromkeys(new_files))
+            self.file_listbox.insert(
+                "end",
+                "".join(f"{i}. {file}\n" for i, file in enumerate(new_files, start))
+            )
+        return len(new_files)
 
     def clear_batch_list(self):
         """清空批量列表"""
-        self.batch_files = []
+        self.batch_files = {}
+        self._batch_keys = set()
         self.update_batch_list()
         self.log("已清空文件列表")
 
     def update_batch_list(self):
-        """更新批量文件列表显示"""
+        """更新批量文件列表显示（拼接成一个字符串，一次插入）"""
         self.file_listbox.delete("1.0", "end")
-        for i, file in enumerate(self.batch_files, 1):
-            self.file_listbox.insert("end", f"{i}. {file}\n")
+        if self.batch_files:
+            self.file_listbox.insert(
+                "1.0",
+                "".join(f"{i}. {file}\n" for i, file in enumerate(self.batch_files, 1))
+            )
 
     def start_batch_ocr(self):
         """开始批量识别"""
@@ -728,59 +952,140 @@ class MainWindow(ctk.CTk):
             messagebox.showwarning("警告", "请先添加要处理的文件")
             return
 
+        # 在主线程取文件列表快照，识别期间对批量列表的修改不影响本次任务
+        files = list(self.batch_files)
+
         def batch_thread():
-            total = len(self.batch_files)
+            total = len(files)
             self.log(f"开始批量识别 {total} 个文件...")
 
+            # 进度按固定频率合并刷新，日志行攒到下次刷新时一次写入；最后一张总会刷新
+            last_update = [0.0]
+            pending_lines = []
+
             def progress_callback(current, total, result):
-                progress = current / total
-                self.progress_bar.set(progress)
-                self.progress_label.configure(text=f"进度: {current}/{total}")
-                self.log(f"[{current}/{total}] 识别完成")
-
-            prompt_map = {
-                "文本识别": "Text Recognition:",
-                "文档解析": "Document Parsing:",
-                "表格识别": "Table Recognition:",
-                "公式识别": "Formula Recognition:"
-            }
-            prompt = prompt_map.get(self.prompt_type.get(), "Text Recognition:")
+                pending_lines.append(f"[{current}/{total}] 识别完成")
+                now = time.monotonic()
+                if current < total and now - last_update[0] < self.PROGRESS_INTERVAL:
+                    return
+                last_update[0] = now
+                self._run_on_ui(self._update_batch_progress, current, total)
+                self.log_lines(pending_lines)
+                pending_lines.clear()
+
+            prompt = PROMPT_MAP.get(self.prompt_type.get(), "Text Recognition:")
 
             results = self.ocr_engine.recognize_batch(
-                self.batch_files,
+                files,
                 prompt=prompt,
                 progress_callback=progress_callback,
                 max_new_tokens=self.current_tokens
             )
 
-            # 保存结果
+            # 保存结果：配置只读取一次，多个文件并行写入
             output_dir = FileUtils.ensure_directory(self.config.get("batch.output_dir"))
-            success_count = 0
-
+            filename_format = self.config.get("batch.filename_format")
+            date_format = self.config.get("batch.date_format")
+            output_format = self.config.get("ocr.output_format")
+
+            # 先在本线程依次确定输出文件名：不同子目录下的同名图片会生成相同的文件名，
+            # 重复时追加 _2、_3 … 序号，保证并行写入的每个任务对应不同的文件
+            jobs = []
+            used_names = set()
             for result in results:
-                if result["success"]:
-                    filename = FileUtils.generate_output_filename(
-                        Path(result["image"]).name,
-                        self.config.get("batch.filename_format"),
-                        self.config.get("batch.date_format"),
-                        self.config.get("ocr.output_format")
-                    )
-                    output_path = output_dir / filename
-
-                    if FileUtils.save_result(
-                            result["text"],
-                            output_path,
-                            self.config.get("ocr.output_format")
-                    ):
-                        success_count += 1
+                if not result["success"]:
+                    continue
+                filename = FileUtils.generate_output_filename(
+                    Path(result["image"]).name,
+                    filename_format,
+                    date_format,
+                    output_format
+                )
+                stem, suffix = os.path.splitext(filename)
+                counter = 1
+                while os.path.normcase(filename) in used_names:
+                    counter += 1
+                    filename = f"{stem}_{counter}{suffix}"
+                used_names.add(os.path.normcase(filename))
+                jobs.append((result["text"], output_dir / filename))
+
+            with ThreadPoolExecutor(max_workers=self.SAVE_WORKERS) as saver:
+                saved = saver.map(
+                    lambda job: FileUtils.save_result(job[0], job[1], output_format),
+                    jobs
+                )
+                success_count = sum(1 for ok in saved if ok)
 
             self.log(f"✓ 批量识别完成: {success_count}/{total} 成功")
-            messagebox.showinfo("完成", f"批量识别完成\n成功: {success_count}/{total}")
+            self._run_on_ui(messagebox.showinfo, "完成", f"批量识别完成\n成功: {success_count}/{total}")
+
+        if not self._begin_ocr():
+            return
+        threading.Thread(target=self._run_ocr_task, args=(batch_thread,), daemon=True).start()
+
+    def _ocr_busy(self) -> bool:
+        """
+        是否有识别任务在进行（快捷键等入口在打开对话框、更新预览之前检查）
+
+        Returns:
+            进行中时记录日志并返回 True
+        """
+        if self._ocr_lock.locked():
+            self.log("识别任务进行中，请等待完成")
+            return True
+        return False
+
+    def _begin_ocr(self) -> bool:
+        """
+        占用识别锁并禁用识别按钮（主线程调用）
+
+        Returns:
+            已有识别任务在进行时返回 False
+        """
+        if not self._ocr_lock.acquire(blocking=False):
+            self.log("识别任务进行中，请等待完成")
+            return False
+        for button in self._ocr_buttons():
+            button.configure(state="disabled")
+        return True
+
+    def _run_ocr_task(self, task):
+        """在工作线程中执行识别任务，结束后释放识别锁并恢复按钮"""
+        try:
+            task()
+        except Exception as e:
+            self.log(f"✗ 识别任务异常: {e}")
+        finally:
+            self._ocr_lock.release()
+            for button in self._ocr_buttons():
+                self._run_on_ui(button.configure, state="normal")
+
+    def _ocr_buttons(self):
+        """会发起识别或修改批量列表的按钮"""
+        return (
+            self.btn_clipboard,
+            self.btn_quick_ocr,
+            self.btn_select_image,
+            self.btn_start_batch,
+            self.btn_add_files,
+            self.btn_add_folder,
+            self.btn_clear_list,
+        )
 
-        threading.Thread(target=batch_thread, daemon=True).start()
+    def _update_batch_progress(self, current: int, total: int):
+        """更新批量识别进度条和进度文字（仅主线程）"""
+        self.progress_bar.set(current / total)
+        self.progress_label.configure(text=f"进度: {current}/{total}")
 
     def on_prompt_change(self, value):
-        """提示词类型变化"""
+        """提示词类型变化：连续切换时只记录最后一次选择"""
+        if self._prompt_after_id is not None:
+            self.after_cancel(self._prompt_after_id)
+        self._prompt_after_id = self.after(self.PROMPT_LOG_DELAY_MS, self._log_prompt_change, value)
+
+    def _log_prompt_change(self, value):
+        """记录最终选定的识别类型"""
+        self._prompt_after_id = None
         self.log(f"切换识别类型: {value}")
 
     def on_token_change(self, value):
@@ -925,12 +1230,65 @@ class MainWindow(ctk.CTk):
             row=2, column=0, columnspan=3, pady=(20, 10)
         )
 
+    def _run_on_ui(self, func, *args, **kwargs):
+        """
+        在主线程中执行界面操作：主线程内直接调用，工作线程中放入界面更新队列
+
+        Args:
+            func: 要执行的函数（通常是控件方法）
+        """
+        if threading.current_thread() is threading.main_thread():
+            func(*args, **kwargs)
+        else:
+            self._ui_queue.put((func, args, kwargs))
+
+    def _drain_ui_queue(self):
+        """主线程定时处理工作线程提交的界面更新"""
+        for _ in range(self.UI_QUEUE_BATCH):
+            try:
+                func, args, kwargs = self._ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                print(f"界面更新失败: {e}")
+        self._flush_log()
+        self.after(self.UI_QUEUE_INTERVAL_MS, self._drain_ui_queue)
+
     def log(self, message: str):
-        """添加日志"""
-        from datetime import datetime
+        """添加日志（可在任意线程调用）"""
+        self.log_lines([message])
+
+    def log_lines(self, messages):
+        """
+        一次添加多条日志（可在任意线程调用）
+
+        日志先放入缓冲区，由主线程在下一个界面更新周期合并为一次文本框插入
+        """
+        if not messages:
+            return
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.log_text.insert("end", f"[{timestamp}] {message}\n")
-        self.log_text.see("end")
+        with self._log_lock:
+            self._log_pending.extend(f"[{timestamp}] {m}\n" for m in messages)
+
+    def _flush_log(self):
+        """把缓冲的日志一次写入日志区，超过 LOG_MAX_LINES 时裁掉最早的行（仅主线程）"""
+        with self._log_lock:
+            if not self._log_pending:
+                return
+            text = "".join(self._log_pending)
+            self._log_pending.clear()
+
+        # 插入前视图已在底部时才自动滚动，用户向上翻看历史时不被拉回末尾
+        at_bottom = self.log_text.yview()[1] > 0.99
+        self.log_text.insert("end", text)
+        line_count = int(self.log_text.index("end-1c").split(".")[0])
+        if line_count > self.LOG_MAX_LINES:
+            last_removed = line_count - self.LOG_MAX_LINES + self.LOG_TRIM_LINES
+            self.log_text.delete("1.0", f"{last_removed + 1}.0")
+        if at_bottom:
+            self.log_text.see("end")
 
     def clear_log(self):
         """清空日志"""
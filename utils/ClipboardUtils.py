@@ -3,13 +3,189 @@
 处理剪贴板图片和文本
 """
 import io
+import sys
+import time
+import struct
 from PIL import Image, ImageGrab
-from typing import Optional
+from typing import Optional, Tuple
+
+# grabclipboard 结果缓存：has_image() 之后紧接着 get_image_from_clipboard() 时复用同一次读取。
+# Windows 上以剪贴板序列号为键（内容不变则一直有效），其他平台按短时间 TTL 失效
+_grab_cache = {"seq": None, "data": None, "time": 0.0}
+_GRAB_CACHE_TTL = 0.25
+
+
+def _clipboard_sequence() -> Optional[int]:
+    """获取 Windows 剪贴板序列号，其他平台返回 None"""
+    if sys.platform != 'win32':
+        return None
+    try:
+        return _get_win32_api()[0].GetClipboardSequenceNumber()
+    except Exception:
+        return None
+
+
+# 可选依赖缓存：None 表示尚未导入，False 表示未安装（不再重复尝试导入）
+_pyperclip = None
+_win32clipboard = None
+
+
+def _get_pyperclip():
+    """返回 pyperclip 模块（首次调用时导入并缓存），未安装时抛出 RuntimeError"""
+    global _pyperclip
+    if _pyperclip is None:
+        try:
+            import pyperclip
+            _pyperclip = pyperclip
+        except ImportError:
+            _pyperclip = False
+    if _pyperclip is False:
+        raise RuntimeError("未安装 pyperclip，请运行: pip install pyperclip")
+    return _pyperclip
+
+
+def _get_win32clipboard():
+    """返回 win32clipboard 模块（首次调用时导入并缓存），不可用时抛出 ImportError"""
+    global _win32clipboard
+    if _win32clipboard is None:
+        try:
+            import win32clipboard
+            _win32clipboard = win32clipboard
+        except ImportError:
+            _win32clipboard = False
+    if _win32clipboard is False:
+        raise ImportError("win32clipboard 不可用（Windows 上请运行: pip install pywin32）")
+    return _win32clipboard
+
+
+_win32_api = None
+
+
+def _get_win32_api():
+    """
+    获取配置好参数类型的 (user32, kernel32)，仅 Windows 可用
+
+    句柄和指针需要声明为指针宽度类型，否则 64 位系统上会被截断为 int。
+    使用本模块私有的 WinDLL 实例，不修改 ctypes.windll 中其他模块共用的函数原型
+    """
+    global _win32_api
+    if _win32_api is None:
+        import ctypes
+        from ctypes import wintypes
+
+        user32 = ctypes.WinDLL("user32", use_last_error=True)
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        user32.GetClipboardData.restype = wintypes.HANDLE
+        user32.GetClipboardData.argtypes = [wintypes.UINT]
+        kernel32.GlobalAlloc.restype = wintypes.HGLOBAL
+        kernel32.GlobalAlloc.argtypes = [wintypes.UINT, ctypes.c_size_t]
+        kernel32.GlobalFree.restype = wintypes.HGLOBAL
+        kernel32.GlobalFree.argtypes = [wintypes.HGLOBAL]
+        kernel32.GlobalLock.restype = ctypes.c_void_p
+        kernel32.GlobalLock.argtypes = [wintypes.HGLOBAL]
+        kernel32.GlobalUnlock.argtypes = [wintypes.HGLOBAL]
+        kernel32.GlobalSize.restype = ctypes.c_size_t
+        kernel32.GlobalSize.argtypes = [wintypes.HGLOBAL]
+        _win32_api = (user32, kernel32)
+    return _win32_api
+
+
+def _read_clipboard_dib() -> Optional[Image.Image]:
+    """
+    通过 ctypes 直接读取 Windows 剪贴板中的 CF_DIB 并构造图片
+
+    解析 BITMAPINFOHEADER 后由 Image.frombuffer 直接解码像素，不经过 BMP 文件解析。
+    仅支持未压缩的 24/32 位 DIB，其他情况返回 None，由调用方回退到 ImageGrab。
+    """
+    import ctypes
+
+    user32, kernel32 = _get_win32_api()
+
+    CF_DIB = 8
+    if not user32.IsClipboardFormatAvailable(CF_DIB):
+        return None
+    if not user32.OpenClipboard(None):
+        return None
+    try:
+        handle = user32.GetClipboardData(CF_DIB)
+        if not handle:
+            return None
+        pointer = kernel32.GlobalLock(handle)
+        if not pointer:
+            return None
+        try:
+            data = ctypes.string_at(pointer, kernel32.GlobalSize(handle))
+        finally:
+            kernel32.GlobalUnlock(handle)
+    finally:
+        user32.CloseClipboard()
+
+    (header_size, width, height, _, bit_count, compression,
+     _, _, _, colors_used, _) = struct.unpack_from('<IiiHHIIiiII', data)
+
+    offset = header_size + colors_used * 4
+    if bit_count == 24 and compression == 0:
+        rawmode = 'BGR'
+    elif bit_count == 32 and compression in (0, 3):
+        if compression == 3:
+            # BI_BITFIELDS：只接受标准的 BGRX 排列，40 字节头之后紧跟 3 个掩码
+            if header_size == 40:
+                offset += 12
+            if struct.unpack_from('<III', data, 40) != (0xFF0000, 0xFF00, 0xFF):
+                return None
+        rawmode = 'BGRX'
+    else:
+        return None
+
+    # 高度为正表示自底向上存储
+    orientation = -1 if height > 0 else 1
+    height = abs(height)
+    stride = (width * bit_count // 8 + 3) & ~3
+    if width <= 0 or height == 0 or len(data) < offset + stride * height:
+        return None
+
+    return Image.frombuffer(
+        'RGB', (width, height), memoryview(data)[offset:],
+        'raw', rawmode, stride, orientation
+    )
 
 
 class ClipboardUtils:
     """剪贴板工具类"""
 
+    @staticmethod
+    def _grab_clipboard():
+        """
+        读取剪贴板内容（ImageGrab.grabclipboard 的缓存版本）
+
+        Returns:
+            PIL Image、文件路径列表或 None
+        """
+        seq = _clipboard_sequence()
+        now = time.monotonic()
+        if seq is not None:
+            if seq == _grab_cache["seq"]:
+                return _grab_cache["data"]
+        elif _grab_cache["seq"] is None and now - _grab_cache["time"] < _GRAB_CACHE_TTL:
+            return _grab_cache["data"]
+
+        data = None
+        if seq is not None:
+            # Windows：优先直接读取 CF_DIB，失败或格式不常见时回退到 ImageGrab
+            try:
+                data = _read_clipboard_dib()
+            except Exception:
+                data = None
+        if data is None:
+            data = ImageGrab.grabclipboard()
+        _grab_cache.update(seq=seq, data=data, time=now)
+        return data
+
+    @staticmethod
+    def invalidate_cache():
+        """清除剪贴板读取缓存（修改剪贴板后调用）"""
+        _grab_cache.update(seq=None, data=None, time=0.0)
+
     @staticmethod
     def get_image_from_clipboard() -> Optional[Image.Image]:
         """
@@ -20,7 +196,7 @@ class ClipboardUtils:
         """
         try:
             # 尝试从剪贴板获取图片
-            image = ImageGrab.grabclipboard()
+            image = ClipboardUtils._grab_clipboard()
 
             if image is None:
                 return None
@@ -53,7 +229,7 @@ class ClipboardUtils:
             是否包含图片
         """
         try:
-            image = ImageGrab.grabclipboard()
+            image = ClipboardUtils._grab_clipboard()
             if image is None:
                 return False
 
@@ -83,38 +259,58 @@ class ClipboardUtils:
             是否成功
         """
         try:
-            import pyperclip
-            pyperclip.copy(text)
+            _get_pyperclip().copy(text)
+            ClipboardUtils.invalidate_cache()
             return True
         except Exception as e:
             print(f"复制到剪贴板失败: {e}")
             return False
 
     @staticmethod
-    def set_image_to_clipboard(image: Image.Image) -> bool:
+    def set_image_to_clipboard(image: Image.Image, prefer_png: bool = True) -> bool:
         """
         设置图片到剪贴板
 
         Args:
             image: PIL Image 对象
+            prefer_png: 是否同时写入 "PNG" 格式（体积远小于未压缩的 DIB，
+                        支持 PNG 的程序会优先读取它；CF_DIB 始终写入以兼容旧程序）
 
         Returns:
             是否成功
         """
         try:
             # 使用 win32clipboard (Windows)
-            import win32clipboard
-            from io import BytesIO
+            win32clipboard = _get_win32clipboard()
+
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
 
-            output = BytesIO()
-            image.convert('RGB').save(output, 'BMP')
-            data = output.getvalue()[14:]  # BMP 文件头是 14 字节
-            output.close()
+            png = None
+            if prefer_png:
+                buffer = io.BytesIO()
+                # 最低压缩级别：编码快，体积仍比 DIB 小很多
+                image.save(buffer, 'PNG', compress_level=1, optimize=False)
+                png = buffer.getvalue()
 
-            win32clipboard.OpenClipboard()
-            win32clipboard.EmptyClipboard()
-            win32clipboard.SetClipboardData(win32clipboard.CF_DIB, data)
-            win32clipboard.CloseClipboard()
+            # DIB 直接写入 HGLOBAL，设置成功后句柄归剪贴板所有，失败时需自行释放
+            # （先分配再打开剪贴板，缩短占用剪贴板的时间；打开失败时同样释放句柄）
+            dib_handle = ClipboardUtils._image_to_dib_handle(image)
+            try:
+                win32clipboard.OpenClipboard()
+                try:
+                    win32clipboard.EmptyClipboard()
+                    if png is not None:
+                        png_format = win32clipboard.RegisterClipboardFormat("PNG")
+                        win32clipboard.SetClipboardData(png_format, png)
+                    win32clipboard.SetClipboardData(win32clipboard.CF_DIB, dib_handle)
+                    dib_handle = None
+                finally:
+                    win32clipboard.CloseClipboard()
+            finally:
+                if dib_handle:
+                    _get_win32_api()[1].GlobalFree(dib_handle)
+            ClipboardUtils.invalidate_cache()
             return True
 
         except ImportError:
@@ -141,4 +337,64 @@ class ClipboardUtils:
 
         except Exception as e:
             print(f"设置剪贴板图片失败: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    @staticmethod
+    def _image_to_dib(image: Image.Image) -> Tuple[bytes, bytes]:
+        """
+        将图片打包为 CF_DIB 数据（BITMAPINFOHEADER + 自底向上的 BGR 像素）
+
+        手动写 40 字节信息头，像素由 tobytes 的 raw 编码器一次性按 4 字节行对齐输出，
+        不经过 BMP 文件写入和 BytesIO 切片。
+
+        Args:
+            image: RGB 模式的 PIL Image 对象
+
+        Returns:
+            (信息头, 像素数据)
+        """
+        width, height = image.size
+        stride = (width * 3 + 3) & ~3
+        size_image = stride * height
+
+        header = struct.pack(
+            '<IiiHHIIiiII',
+            40, width, height,   # biSize, biWidth, biHeight（正数表示自底向上）
+            1, 24,               # biPlanes, biBitCount
+            0, size_image,       # BI_RGB, biSizeImage
+            2835, 2835,          # 72 DPI
+            0, 0
+        )
+        pixels = image.tobytes('raw', 'BGR', stride, -1)
+        return header, pixels
+
+    @staticmethod
+    def _image_to_dib_handle(image: Image.Image) -> int:
+        """
+        分配 HGLOBAL 并把 DIB 直接 memmove 进去，可直接作为 CF_DIB 句柄交给剪贴板
+
+        Args:
+            image: RGB 模式的 PIL Image 对象
+
+        Returns:
+            HGLOBAL 句柄
+        """
+        import ctypes
+
+        GMEM_MOVEABLE = 0x0002
+        _, kernel32 = _get_win32_api()
+        header, pixels = ClipboardUtils._image_to_dib(image)
+
+        handle = kernel32.GlobalAlloc(GMEM_MOVEABLE, len(header) + len(pixels))
+        if not handle:
+            raise MemoryError("GlobalAlloc 失败")
+        pointer = kernel32.GlobalLock(handle)
+        if not pointer:
+            kernel32.GlobalFree(handle)
+            raise MemoryError("GlobalLock 失败")
+        try:
+            ctypes.memmove(pointer, header, len(header))
+            ctypes.memmove(pointer + len(header), pixels, len(pixels))
+        finally:
+            kernel32.GlobalUnlock(handle)
+        return handle
@@ -3,23 +3,84 @@
 处理文件和目录操作
 """
 import os
-import json
+import time
+import heapq
+import string
+import functools
 from pathlib import Path
-from typing import List, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Union
 from datetime import datetime
 from PIL import Image
 
+from utils.JsonUtils import json_dumps
+
+
+@functools.lru_cache(maxsize=8)
+def _format_second(date_format: str, second: int) -> str:
+    """按整秒格式化时间，同一秒内相同格式只调用一次 strftime"""
+    return datetime.fromtimestamp(second).strftime(date_format)
+
+
+@functools.lru_cache(maxsize=8)
+def _is_simple_template(format_template: str) -> bool:
+    """
+    检查文件名模板是否只含 {name}、{date} 这样的简单字段，同一模板只解析一次
+
+    含其他字段、属性/索引访问（{name.attr}、{name[0]}）、转换（{name!r}）、格式说明（{name:>40}）
+    或 {{ }} 转义时返回 False，由调用方回退到逐个字符串替换，与旧版只替换 {name}/{date} 的结果一致
+    （旧版中 {{name}} 得到 {文件名}）
+    """
+    if '{{' in format_template or '}}' in format_template:
+        return False
+    try:
+        return all(
+            field_name is None or (field_name in ("name", "date") and not conversion and not format_spec)
+            for _, field_name, format_spec, conversion in string.Formatter().parse(format_template)
+        )
+    except ValueError:
+        return False
+
+
+def _path_sort_key(path: str) -> List[str]:
+    """
+    路径排序键：按分段比较，与 Path 对象的排序一致
+
+    直接比较整个字符串时 'a-c.png' 会排在 'a/b.png' 之前（'-' 小于分隔符）；
+    normcase 在 Windows 上统一大小写和分隔符
+    """
+    return os.path.normcase(path).split(os.sep)
+
 
 class FileUtils:
     """文件工具类"""
 
     # 支持的图片格式
     SUPPORTED_IMAGE_FORMATS = {'.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp', '.tiff'}
+    # str.endswith 可直接接受元组，一次调用检查所有扩展名
+    _IMAGE_EXTENSIONS = tuple(SUPPORTED_IMAGE_FORMATS)
+
+    # 常见的无关目录，需要时作为 skip_dirs 传入
+    DEFAULT_SKIP_DIRS = frozenset({'.git', '__pycache__', '.venv', 'node_modules'})
+
+    # 图片格式魔数（WebP 为 RIFF 容器，单独判断）
+    _IMAGE_MAGICS = (
+        b'\x89PNG',      # PNG
+        b'\xff\xd8\xff',  # JPEG
+        b'BM',           # BMP
+        b'GIF8',         # GIF
+        b'II*\x00',      # TIFF（小端）
+        b'MM\x00*',      # TIFF（大端）
+    )
 
     @staticmethod
     def get_images_from_directory(
             directory: Union[str, Path],
-            recursive: bool = False
+            recursive: bool = False,
+            max_depth: Optional[int] = None,
+            skip_dirs: Optional[Set[str]] = None,
+            dir_filter: Optional[Callable[[str], bool]] = None,
+            limit: Optional[int] = None
     ) -> List[Path]:
         """
         从目录获取所有图片文件
@@ -27,60 +88,154 @@ class FileUtils:
         Args:
             directory: 目录路径
             recursive: 是否递归搜索子目录
+            max_depth: 递归时最多进入的子目录层数（None 表示不限制）
+            skip_dirs: 递归时跳过的目录名（None 表示不跳过，可传入 DEFAULT_SKIP_DIRS）
+            dir_filter: 递归时的目录过滤函数，接收目录路径，返回 False 则不进入
+            limit: 只返回排序后的前 limit 个（用堆选取，不保存和排序全部结果）
 
         Returns:
             图片文件路径列表
         """
         directory = Path(directory)
-        if not directory.exists() or not directory.is_dir():
+        if not directory.is_dir():
             return []
 
-        images = []
+        if not recursive:
+            max_depth = 0
+        if skip_dirs is None:
+            skip_dirs = frozenset()
 
-        if recursive:
-            for root, _, files in os.walk(directory):
-                for file in files:
-                    file_path = Path(root) / file
-                    if file_path.suffix.lower() in FileUtils.SUPPORTED_IMAGE_FORMATS:
-                        images.append(file_path)
+        entries = FileUtils._scan_images(os.fspath(directory), 0, max_depth, skip_dirs, dir_filter)
+        paths = (entry.path for entry in entries)
+        # 按路径分段排序（与 Path 对象的比较顺序一致），只在最后为结果构造 Path
+        if limit is not None:
+            paths = heapq.nsmallest(limit, paths, key=_path_sort_key)
         else:
-            for file in directory.iterdir():
-                if file.is_file() and file.suffix.lower() in FileUtils.SUPPORTED_IMAGE_FORMATS:
-                    images.append(file)
+            paths = sorted(paths, key=_path_sort_key)
+        return [Path(p) for p in paths]
 
-        return sorted(images)
+    @staticmethod
+    def _scan_images(
+            path: str,
+            depth: int,
+            max_depth: Optional[int],
+            skip_dirs: Set[str],
+            dir_filter: Optional[Callable[[str], bool]]
+    ) -> Iterator[os.DirEntry]:
+        """
+        用 os.scandir 遍历目录，逐个返回扩展名受支持的图片文件
+
+        DirEntry 自带文件类型信息，先按文件名过滤扩展名，只对候选文件判断 is_file，
+        不为每个文件构造 Path 或额外 stat。无权限访问的目录直接跳过（与 os.walk 一致）。
+        子目录在进入之前按深度、目录名和 dir_filter 剪枝。
+        以 . 开头的隐藏文件（如 macOS 的 ._ 资源文件）不作为图片返回；
+        隐藏目录照常进入，目录剪枝只由 skip_dirs / dir_filter 决定。
+        """
+        descend = max_depth is None or depth < max_depth
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    name = entry.name
+                    try:
+                        if FileUtils._has_image_ext(name) and entry.is_file():
+                            if not name.startswith('.'):
+                                yield entry
+                        elif (descend
+                              and name not in skip_dirs
+                              and entry.is_dir(follow_symlinks=False)
+                              and (dir_filter is None or dir_filter(entry.path))):
+                            yield from FileUtils._scan_images(
+                                entry.path, depth + 1, max_depth, skip_dirs, dir_filter
+                            )
+                    except OSError:
+                        continue
+        except OSError:
+            return
 
     @staticmethod
-    def validate_image(image_path: Union[str, Path]) -> bool:
+    def validate_image(image_path: Union[str, Path], deep: bool = False) -> bool:
         """
         验证图片是否有效
 
+        默认只检查文件头：先比对魔数，再让 PIL 解析图片头（不解码像素），
+        只读取文件开头几 KB，适合在批量识别前快速检查整个目录。
+
         Args:
             image_path: 图片路径
+            deep: 是否完整校验（调用 verify()，会读取整个文件并校验数据块）
 
         Returns:
             是否为有效图片
         """
         try:
-            with Image.open(image_path) as img:
-                img.verify()
+            with open(image_path, 'rb') as f:
+                header = f.read(32)
+                if not FileUtils._match_image_magic(header):
+                    return False
+                f.seek(0)
+                with Image.open(f) as img:
+                    if deep:
+                        img.verify()
+                    else:
+                        # 访问 size 即可确认图片头解析成功
+                        width, height = img.size
+                        if width <= 0 or height <= 0:
+                            return False
             return True
         except Exception:
             return False
 
+    @staticmethod
+    def validate_many(
+            image_paths: Iterable[Union[str, Path]],
+            deep: bool = False
+    ) -> Dict[Union[str, Path], bool]:
+        """
+        并行验证多张图片
+
+        验证主要是读取文件头的 I/O，线程在系统调用期间会释放 GIL，可以重叠等待时间。
+        线程数为 CPU 核数的 4 倍，限制在 4~32 之间，避免机械硬盘上过多的随机读。
+
+        Args:
+            image_paths: 图片路径列表
+            deep: 是否完整校验（见 validate_image）
+
+        Returns:
+            {路径: 是否为有效图片}
+        """
+        image_paths = list(image_paths)
+        if not image_paths:
+            return {}
+
+        workers = min(32, max(4, (os.cpu_count() or 1) * 4), len(image_paths))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda p: FileUtils.validate_image(p, deep), image_paths)
+            return dict(zip(image_paths, results))
+
+    @staticmethod
+    def _match_image_magic(header: bytes) -> bool:
+        """根据文件开头的魔数判断是否为支持的图片格式"""
+        if header.startswith(FileUtils._IMAGE_MAGICS):
+            return True
+        return header[:4] == b'RIFF' and header[8:12] == b'WEBP'
+
     @staticmethod
     def save_result(
             text: str,
             output_path: Union[str, Path],
-            format: str = "txt"
+            format: str = "txt",
+            fsync: bool = False
     ) -> bool:
         """
         保存识别结果
 
+        先在内存中拼好完整内容，再以二进制方式一次写入（不做换行符转换）
+
         Args:
             text: 识别结果文本
             output_path: 输出文件路径
             format: 输出格式 (txt, json, markdown)
+            fsync: 是否在写入后调用 os.fsync 确保落盘
 
         Returns:
             是否保存成功
@@ -90,22 +245,26 @@ class FileUtils:
             output_path.parent.mkdir(parents=True, exist_ok=True)
 
             if format == "txt":
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    f.write(text)
-
+                payload = text.encode('utf-8')
             elif format == "json":
                 data = {
                     "timestamp": datetime.now().isoformat(),
                     "text": text
                 }
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-
+                payload = json_dumps(data)
             elif format == "markdown":
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    f.write(f"# OCR Result\n\n")
-                    f.write(f"**Date:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-                    f.write(f"## Content\n\n{text}\n")
+                payload = (
+                    f"# OCR Result\n\n"
+                    f"**Date:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+                    f"## Content\n\n{text}\n"
+                ).encode('utf-8')
+            else:
+                return True
+
+            with open(output_path, 'wb') as f:
+                f.write(payload)
+                if fsync:
+                    os.fsync(f.fileno())
 
             return True
 
@@ -133,10 +292,19 @@ class FileUtils:
             生成的文件名
         """
         name_without_ext = Path(original_name).stem
-        current_date = datetime.now().strftime(date_format)
+        if "%f" in date_format:
+            # 含微秒的格式不能按秒缓存
+            current_date = datetime.now().strftime(date_format)
+        else:
+            current_date = _format_second(date_format, int(time.time()))
 
-        filename = format_template.replace("{name}", name_without_ext)
-        filename = filename.replace("{date}", current_date)
+        if _is_simple_template(format_template):
+            filename = format_template.format_map({"name": name_without_ext, "date": current_date})
+        else:
+            # 模板含其他占位符、属性/索引访问、转换/格式说明或花括号转义时，
+            # 按旧方式只替换 {name} 和 {date}
+            filename = format_template.replace("{name}", name_without_ext)
+            filename = filename.replace("{date}", current_date)
 
         return f"{filename}.{extension}"
 
@@ -156,17 +324,24 @@ class FileUtils:
         return directory
 
     @staticmethod
-    def get_file_size_mb(file_path: Union[str, Path]) -> float:
+    def get_file_size_mb(file_path: Union[str, Path, os.DirEntry, int]) -> float:
         """
         获取文件大小（MB）
 
         Args:
-            file_path: 文件路径
+            file_path: 文件路径；也可传入 os.scandir 的 DirEntry（复用其 stat 缓存）
+                       或已知的字节数
 
         Returns:
             文件大小（MB）
         """
-        return Path(file_path).stat().st_size / (1024 * 1024)
+        if isinstance(file_path, int):
+            size = file_path
+        elif isinstance(file_path, os.DirEntry):
+            size = file_path.stat().st_size
+        else:
+            size = os.stat(os.fspath(file_path)).st_size
+        return size / (1 << 20)
 
     @staticmethod
     def is_image_file(file_path: Union[str, Path]) -> bool:
@@ -179,4 +354,9 @@ class FileUtils:
         Returns:
             是否为图片文件
         """
-        return Path(file_path).suffix.lower() in FileUtils.SUPPORTED_IMAGE_FORMATS
\ No newline at end of file
+        return FileUtils._has_image_ext(os.fspath(file_path))
+
+    @staticmethod
+    def _has_image_ext(name: str) -> bool:
+        """根据文件名判断扩展名是否受支持（不构造 Path 对象）"""
+        return name.lower().endswith(FileUtils._IMAGE_EXTENSIONS)
\ No newline at end of file
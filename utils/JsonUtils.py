@@ -0,0 +1,40 @@
+"""
+JSON 工具模块
+优先使用 orjson（C 实现，读写更快），未安装时回退到标准库 json
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_loads(data):
+    """
+    解析 JSON
+
+    Args:
+        data: JSON 文本（str 或 UTF-8 编码的 bytes）
+
+    Returns:
+        解析结果
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj) -> bytes:
+    """
+    序列化为带 2 空格缩进的 UTF-8 JSON（中文不转义）
+
+    Args:
+        obj: 要序列化的对象
+
+    Returns:
+        UTF-8 编码的 JSON 字节串
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
@@ -6,43 +6,110 @@ from pathlib import Path
 from typing import Union, List, Dict
 from PIL import Image
 
+# pyzbar 模块缓存：None 表示尚未导入，False 表示未安装（不再重复尝试导入）
+_pyzbar = None
+
+
+def _get_pyzbar():
+    """返回 pyzbar 模块（首次调用时导入并缓存），未安装时抛出 RuntimeError"""
+    global _pyzbar
+    if _pyzbar is None:
+        try:
+            from pyzbar import pyzbar
+            _pyzbar = pyzbar
+        except ImportError:
+            _pyzbar = False
+    if _pyzbar is False:
+        raise RuntimeError("未安装 pyzbar，无法识别二维码，请运行: pip install pyzbar")
+    return _pyzbar
+
 
 class QRCodeUtils:
     """二维码工具类"""
 
+    # 多尺度扫描时首先尝试的最长边（大图先缩小扫描，速度更快）
+    FAST_MAX_SIDE = 1600
+    # 原图仍未识别到时依次尝试的缩放比例
+    RETRY_SCALES = (0.75, 0.5)
+    # 与已扫描过的最长边相差不到该比例的尺度视为重复，跳过
+    SCALE_TOLERANCE = 0.15
+
     @staticmethod
-    def decode_qrcodes(image: Union[str, Path, Image.Image]) -> List[Dict[str, str]]:
+    def decode_qrcodes(
+            image: Union[str, Path, Image.Image],
+            multi_scale: bool = True
+    ) -> List[Dict[str, str]]:
         """
         解码图片中的二维码
 
+        图片只打开并转为灰度一次（ZBar 只使用亮度通道），再按尺度阶梯依次扫描，
+        识别到二维码即停止：最长边超过 FAST_MAX_SIDE 的图片先缩小扫描，
+        再扫描原图（很小的二维码可能在缩小后丢失），最后按 RETRY_SCALES 缩小重试
+        （对过大或模糊的二维码有效）。与已扫描尺寸接近的尺度会跳过。
+
         Args:
             image: 图片路径或 PIL Image 对象
+            multi_scale: 为 False 时只按原图分辨率扫描一次
 
         Returns:
             解码结果列表 [{"data": "https://...", "type": "QRCODE"}, ...]
+
+        Raises:
+            RuntimeError: 未安装 pyzbar
         """
-        try:
-            from pyzbar import pyzbar
-        except ImportError:
-            print("请安装 pyzbar: pip install pyzbar")
-            return []
+        pyzbar = _get_pyzbar()
 
         try:
             if isinstance(image, (str, Path)):
-                image = Image.open(str(image))
-
-            decoded = pyzbar.decode(image)
-            results = []
-            for obj in decoded:
-                results.append({
-                    "data": obj.data.decode("utf-8", errors="replace"),
-                    "type": obj.type
-                })
-            return results
+                with Image.open(str(image)) as img:
+                    image = img.convert('L')
+            elif image.mode != 'L':
+                image = image.convert('L')
+
+            width, height = image.size
+            longest = max(width, height)
+            sides = [longest]
+            if multi_scale:
+                if longest > QRCodeUtils.FAST_MAX_SIDE:
+                    sides.insert(0, QRCodeUtils.FAST_MAX_SIDE)
+                sides.extend(int(longest * scale) for scale in QRCodeUtils.RETRY_SCALES)
+
+            scanned = []
+            decoded = []
+            for side in sides:
+                if any(abs(side - done) <= done * QRCodeUtils.SCALE_TOLERANCE for done in scanned):
+                    continue
+                scanned.append(side)
+                if side == longest:
+                    scaled = image
+                else:
+                    scale = side / longest
+                    scaled = image.resize(
+                        (max(1, int(width * scale)), max(1, int(height * scale))),
+                        Image.Resampling.LANCZOS
+                    )
+                decoded = QRCodeUtils._scan(pyzbar, scaled)
+                if decoded:
+                    break
+
+            return [
+                {"data": obj.data.decode("utf-8", errors="replace"), "type": obj.type}
+                for obj in decoded
+            ]
         except Exception as e:
             print(f"二维码解码失败: {e}")
             return []
 
+    @staticmethod
+    def _scan(pyzbar, image: Image.Image) -> list:
+        """
+        扫描灰度图片中的二维码
+
+        以 (像素, 宽, 高) 元组调用 pyzbar，跳过它对 PIL 图片内部的 convert('L') 复制
+        """
+        width, height = image.size
+        return pyzbar.decode((image.tobytes(), width, height))
+
     @staticmethod
     def format_results(qr_results: List[Dict[str, str]]) -> str:
         """
@@ -57,7 +124,6 @@ class QRCodeUtils:
         if not qr_results:
             return ""
 
-        lines = ["[二维码识别结果]"]
-        for i, result in enumerate(qr_results, 1):
-            lines.append(f"二维码 {i}: {result['data']}")
-        return "\n".join(lines)
+        return "[二维码识别结果]\n" + "\n".join(
+            f"二维码 {i}: {result['data']}" for i, result in enumerate(qr_results, 1)
+        )